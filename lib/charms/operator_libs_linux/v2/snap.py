@@ -11,6 +11,12 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+#
+# Local fork of the Charmhub library, for the juju-dns charm: it adds the
+# in-place index of the snapd names catalog, slotted Snap objects, and the
+# batch and asynchronous change helpers (install_batch, refresh_batch,
+# hold_batch, get_change, wait_for_changes). Don't replace it with
+# `charmcraft fetch-lib`: port upstream changes by hand and bump LIBPATCH.
 
 """Representations of the system's Snaps, and abstractions around managing them.
 
@@ -59,19 +65,22 @@ except snap.SnapError as e:
 import http.client
 import json
 import logging
+import mmap
 import os
 import re
 import socket
 import subprocess
 import sys
+import time
 import urllib.error
 import urllib.parse
 import urllib.request
+from array import array
 from collections.abc import Mapping
 from datetime import datetime, timedelta, timezone
 from enum import Enum
 from subprocess import CalledProcessError, CompletedProcess
-from typing import Any, Dict, Iterable, List, Optional, Union
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Union
 
 logger = logging.getLogger(__name__)
 
@@ -83,12 +92,17 @@ LIBAPI = 2
 
 # Increment this PATCH version before using `charmcraft publish-lib` or reset
 # to 0 if you are raising the major API version
-LIBPATCH = 7
+LIBPATCH = 8
 
 
 # Regex to locate 7-bit C1 ANSI sequences
 ansi_filter = re.compile(r"\x1B(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~])")
 
+# The snapd catalog of available snap names, one per line
+_SNAP_NAMES_PATH = "/var/cache/snapd/names"
+# A line of the catalog, matched in place in the mapped file.
+_CATALOG_LINE = re.compile(rb"[^\n]+")
+
 
 def _cache_init(func):
     def inner(*args, **kwargs):
@@ -106,6 +120,8 @@ JSONType = Union[Dict[str, Any], List[Any], str, int, float]
 class SnapService:
     """Data wrapper for snap services."""
 
+    __slots__ = ("daemon", "daemon_scope", "enabled", "active", "activators")
+
     def __init__(
         self,
         daemon: Optional[str] = None,
@@ -217,6 +233,17 @@ class Snap(object):
       - confinement: "classic", "strict", or "devmode"
     """
 
+    __slots__ = (
+        "_name",
+        "_state",
+        "_channel",
+        "_revision",
+        "_confinement",
+        "_cohort",
+        "_apps",
+        "_snap_client",
+    )
+
     def __init__(
         self,
         name,
@@ -226,6 +253,7 @@ class Snap(object):
         confinement: str,
         apps: Optional[List[Dict[str, str]]] = None,
         cohort: Optional[str] = "",
+        snap_client: Optional["SnapClient"] = None,
     ) -> None:
         self._name = name
         self._state = state
@@ -234,7 +262,7 @@ class Snap(object):
         self._confinement = confinement
         self._cohort = cohort
         self._apps = apps or []
-        self._snap_client = SnapClient()
+        self._snap_client = snap_client or SnapClient()
 
     def __eq__(self, other) -> bool:
         """Equality for comparison."""
@@ -249,7 +277,8 @@ class Snap(object):
 
     def __repr__(self):
         """Represent the object such that it can be reconstructed."""
-        return "<{}.{}: {}>".format(self.__module__, self.__class__.__name__, self.__dict__)
+        attributes = {slot: getattr(self, slot) for slot in self.__slots__}
+        return "<{}.{}: {}>".format(self.__module__, self.__class__.__name__, attributes)
 
     def __str__(self):
         """Represent the snap object as a string."""
@@ -677,6 +706,47 @@ class Snap(object):
         return "hold:" in info
 
 
+class SnapChange:
+    """Progress of an asynchronous snapd change, as returned by `get_change`.
+
+    `SnapChange` exposes the following properties about a change:
+      - id: the snapd change ID
+      - kind: e.g. "install-snap"
+      - status: "Do", "Doing", "Done", "Error", ...
+      - ready: whether snapd has finished working on the change
+      - err: the error message of a failed change
+      - summary: what the change, or its current task, is doing
+      - done, total: the progress of the change, summed over its tasks
+    """
+
+    def __init__(self, info: Dict):
+        self.id = info["id"]
+        self.kind = info.get("kind", "")
+        self.status = info.get("status", "")
+        self.ready = info.get("ready", False)
+        self.err = info.get("err", "")
+        self.summary = info.get("summary", "")
+        self.done = 0
+        self.total = 0
+        for task in info.get("tasks", []):
+            progress = task.get("progress", {})
+            self.done += progress.get("done", 0)
+            self.total += progress.get("total", 0)
+            if task.get("status") == "Doing":
+                self.summary = task.get("summary", self.summary)
+
+    def __repr__(self):
+        """Represent the change."""
+        return "<{}.{}: {} {} {}/{}>".format(
+            self.__module__, self.__class__.__name__, self.id, self.status, self.done, self.total
+        )
+
+    @property
+    def failed(self) -> bool:
+        """Report whether the change is finished but did not succeed."""
+        return self.ready and self.status != "Done"
+
+
 class _UnixSocketConnection(http.client.HTTPConnection):
     """Implementation of HTTPConnection that connects to a named Unix socket."""
 
@@ -755,13 +825,17 @@ class SnapClient:
         path: str,
         query: Dict = None,
         body: Dict = None,
+        fields: Optional[Iterable[str]] = None,
     ) -> JSONType:
         """Make a JSON request to the Snapd server with the given HTTP method and path.
 
         If query dict is provided, it is encoded and appended as a query string
         to the URL. If body dict is provided, it is serialied as JSON and used
         as the HTTP body (with Content-Type: "application/json"). The resulting
-        body is decoded from JSON.
+        body is decoded from JSON. If fields are provided and the result is a
+        list of objects, only those fields of each object are kept once it is
+        parsed: this shrinks what the caller retains, not the peak memory of
+        the request.
         """
         headers = {"Accept": "application/json"}
         data = None
@@ -770,7 +844,18 @@ class SnapClient:
             headers["Content-Type"] = "application/json"
 
         response = self._request_raw(method, path, query, headers, data)
-        return json.loads(response.read().decode())["result"]
+        result = json.loads(response.read())["result"]
+        if fields is not None and isinstance(result, list):
+            fields = tuple(fields)
+            result = [{key: item[key] for key in fields if key in item} for item in result]
+        return result
+
+    def _request_async(self, method: str, path: str, body: Dict) -> str:
+        """Make a JSON request for an asynchronous snapd operation; return the change ID."""
+        headers = {"Accept": "application/json", "Content-Type": "application/json"}
+        data = json.dumps(body).encode("utf-8")
+        response = self._request_raw(method, path, None, headers, data)
+        return json.loads(response.read().decode())["change"]
 
     def _request_raw(
         self,
@@ -806,9 +891,13 @@ class SnapClient:
             raise SnapAPIError({}, 500, "Not found", e.reason)
         return response
 
-    def get_installed_snaps(self) -> Dict:
-        """Get information about currently installed snaps."""
-        return self._request("GET", "snaps")
+    def get_installed_snaps(self, fields: Optional[Iterable[str]] = None) -> List:
+        """Get information about currently installed snaps.
+
+        Args:
+            fields: (optional) the fields to keep for each snap, all of them by default
+        """
+        return self._request("GET", "snaps", fields=fields)
 
     def get_snap_information(self, name: str) -> Dict:
         """Query the snap server for information about single snap."""
@@ -818,36 +907,156 @@ class SnapClient:
         """Query the snap server for apps belonging to a named, currently installed snap."""
         return self._request("GET", "apps", {"names": name, "select": "service"})
 
+    def snap_action(self, name: str, action: str, options: Optional[Dict] = None) -> str:
+        """Start an action ("install", "refresh", "remove", ...) on a snap; return the change ID.
+
+        Args:
+            name: the name of the snap
+            action: the snapd action
+            options: additional snapd options for the action, e.g. {"channel": "edge"}
+        """
+        return self._request_async(
+            "POST", "snaps/{}".format(name), {"action": action, **(options or {})}
+        )
+
+    def snaps_action(self, action: str, names: List[str], options: Optional[Dict] = None) -> str:
+        """Start an action on several snaps in a single snapd change; return the change ID.
+
+        Args:
+            action: the snapd multi-snap action ("install", "refresh", "hold", ...)
+            names: the names of the snaps
+            options: additional snapd options for the action, e.g. {"time": "forever"}
+        """
+        body = {"action": action, "snaps": list(names), **(options or {})}
+        return self._request_async("POST", "snaps", body)
+
+    def get_change(self, change_id: str) -> SnapChange:
+        """Query the snap server for the progress of a change."""
+        return SnapChange(self._request("GET", "changes/{}".format(change_id)))
+
+
+class _SnapCatalog:
+    """Sorted index of the snapd catalog of available snap names.
+
+    The catalog file is memory-mapped and only the offsets of its lines are kept,
+    sorted by name, so membership is a binary search over the mapped file. Nothing
+    is read until the first lookup.
+    """
+
+    def __init__(self, path: str):
+        self._path = path
+        self._data = None
+        self._offsets = None
+
+    def load(self) -> None:
+        """Map the catalog file and index its lines, unless already done."""
+        if self._offsets is not None:
+            return
+        # 32-bit offsets: the catalog is a few MiB at most.
+        self._offsets = array("I")
+        if not os.path.isfile(self._path):
+            # The snap catalog may not be populated yet; this is normal.
+            # snapd updates the cache infrequently and the cache file may not
+            # currently exist.
+            return
+
+        with open(self._path, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return
+            self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        # Scan the mapped file in place, collecting line offsets and checking the
+        # order on the way. snapd writes the catalog sorted, so sorting is a fallback.
+        previous, in_order = b"", True
+        for line in _CATALOG_LINE.finditer(self._data):
+            name = line[0].strip()
+            if name and name != previous:
+                in_order = in_order and name > previous
+                self._offsets.append(line.start())
+                previous = name
+        if not in_order:
+            self._sort()
+
+    def _sort(self) -> None:
+        """Sort the offsets by name and drop duplicate names."""
+        offsets = sorted(self._offsets, key=self._name_at)
+        self._offsets = array("I")
+        previous = None
+        for offset in offsets:
+            name = self._name_at(offset)
+            if name != previous:
+                self._offsets.append(offset)
+                previous = name
+
+    def _name_at(self, offset: int) -> bytes:
+        """Return the name on the line starting at `offset`."""
+        end = self._data.find(b"\n", offset)
+        return self._data[offset : end if end != -1 else len(self._data)].strip()
+
+    def __contains__(self, name: str) -> bool:
+        """Binary search the catalog for `name`."""
+        self.load()
+        key = name.encode()
+        lo, hi = 0, len(self._offsets)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._name_at(self._offsets[mid]) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo < len(self._offsets) and self._name_at(self._offsets[lo]) == key
+
+    def __len__(self) -> int:
+        """Report the number of names in the catalog."""
+        self.load()
+        return len(self._offsets)
+
+    def __iter__(self) -> Iterator[str]:
+        """Iterate over the catalog names in sorted order."""
+        self.load()
+        for offset in self._offsets:
+            yield self._name_at(offset).decode()
+
 
 class SnapCache(Mapping):
     """An abstraction to represent installed/available packages.
 
     When instantiated, `SnapCache` iterates through the list of installed
-    snaps using the `snapd` HTTP API, and a list of available snaps by reading
-    the filesystem to populate the cache. Information about available snaps is lazily-loaded
-    from the `snapd` API when requested.
+    snaps using the `snapd` HTTP API. The list of available snaps is read from
+    the filesystem only when membership or iteration needs it. Information about
+    available snaps is lazily-loaded from the `snapd` API when requested.
     """
 
+    # The fields of the snapd snap documents used to build `Snap` objects
+    _SNAP_FIELDS = ("name", "channel", "revision", "confinement", "apps")
+
     def __init__(self):
         if not self.snapd_installed:
             raise SnapError("snapd is not installed or not in /usr/bin") from None
         self._snap_client = SnapClient()
         self._snap_map = {}
+        self._catalog = _SnapCatalog(_SNAP_NAMES_PATH)
         if self.snapd_installed:
-            self._load_available_snaps()
             self._load_installed_snaps()
 
     def __contains__(self, key: str) -> bool:
         """Check if a given snap is in the cache."""
-        return key in self._snap_map
+        return key in self._snap_map or key in self._catalog
 
     def __len__(self) -> int:
         """Report number of items in the snap cache."""
-        return len(self._snap_map)
+        return len(self._catalog) + sum(1 for name in self._snap_map if name not in self._catalog)
 
     def __iter__(self) -> Iterable["Snap"]:
-        """Provide iterator for the snap cache."""
-        return iter(self._snap_map.values())
+        """Provide iterator for the snap cache.
+
+        Available snaps which have not been looked up yet are yielded as None.
+        """
+        for name in self._catalog:
+            yield self._snap_map.get(name)
+        for name, snap in self._snap_map.items():
+            if name not in self._catalog:
+                yield snap
 
     def __getitem__(self, snap_name: str) -> Snap:
         """Return either the installed version or latest version for a given snap."""
@@ -870,22 +1079,13 @@ class SnapCache(Mapping):
     def _load_available_snaps(self) -> None:
         """Load the list of available snaps from disk.
 
-        Leave them empty and lazily load later if asked for.
+        Only names are indexed; the snaps themselves are lazily loaded if asked for.
         """
-        if not os.path.isfile("/var/cache/snapd/names"):
-            # The snap catalog may not be populated yet; this is normal.
-            # snapd updates the cache infrequently and the cache file may not
-            # currently exist.
-            return
-
-        with open("/var/cache/snapd/names", "r") as f:
-            for line in f:
-                if line.strip():
-                    self._snap_map[line.strip()] = None
+        self._catalog.load()
 
     def _load_installed_snaps(self) -> None:
         """Load the installed snaps into the dict."""
-        installed = self._snap_client.get_installed_snaps()
+        installed = self._snap_client.get_installed_snaps(fields=self._SNAP_FIELDS)
 
         for i in installed:
             snap = Snap(
@@ -895,6 +1095,7 @@ class SnapCache(Mapping):
                 revision=i["revision"],
                 confinement=i["confinement"],
                 apps=i.get("apps", None),
+                snap_client=self._snap_client,
             )
             self._snap_map[snap.name] = snap
 
@@ -913,6 +1114,7 @@ class SnapCache(Mapping):
             revision=info["revision"],
             confinement=info["confinement"],
             apps=None,
+            snap_client=self._snap_client,
         )
 
 
@@ -1114,6 +1316,148 @@ def install_local(
         raise SnapError("Could not install snap {}: {}".format(filename, e.output))
 
 
+def _action_options(
+    channel: Optional[str] = "",
+    revision: Optional[str] = None,
+    classic: Optional[bool] = False,
+    devmode: bool = False,
+    cohort: Optional[str] = "",
+) -> Dict:
+    """Translate snap install/refresh arguments into snapd API options."""
+    options = {}
+    if channel:
+        options["channel"] = channel
+    if revision:
+        options["revision"] = str(revision)
+    if classic:
+        options["classic"] = True
+    if devmode:
+        options["devmode"] = True
+    if cohort:
+        options["cohort-key"] = cohort
+    return options
+
+
+def get_change(change_id: str) -> SnapChange:
+    """Return the progress of the snapd change `change_id`.
+
+    Raises:
+        SnapError if snapd does not know the change
+    """
+    try:
+        return SnapClient().get_change(change_id)
+    except SnapAPIError as e:
+        raise SnapError("Could not get snapd change {}: {}".format(change_id, e.message))
+
+
+def _submit_batch(action: str, snaps: Dict[str, Dict]) -> Dict[str, str]:
+    """Submit `action` for several snaps with as few snapd changes as possible."""
+    client = SnapClient()
+    changes = {}
+    options = {name: _action_options(**(args or {})) for name, args in snaps.items()}
+    plain = [name for name, opts in options.items() if not opts]
+    try:
+        if plain:
+            # snapd's multi-snap action takes no per-snap options, so only snaps
+            # without a channel, revision or confinement share a transaction.
+            change_id = client.snaps_action(action, plain)
+            changes.update(dict.fromkeys(plain, change_id))
+        for name, opts in options.items():
+            if opts:
+                changes[name] = client.snap_action(name, action, opts)
+    except SnapAPIError as e:
+        raise SnapError("Could not {} snap(s) {}: {}".format(action, ", ".join(snaps), e.message))
+    return changes
+
+
+def install_batch(snaps: Dict[str, Dict]) -> Dict[str, str]:
+    """Submit the installation of several snaps to snapd without waiting for it.
+
+    Snaps without options are installed in a single multi-snap transaction. snapd
+    does not accept per-snap options in a multi-snap request, so every snap with
+    a pinned channel or revision gets its own change, all submitted before any is
+    waited for.
+
+    Args:
+        snaps: a mapping of snap names to (optional) keyword arguments: channel,
+            revision, classic, devmode, cohort
+
+    Returns:
+        a mapping of snap names to the ID of the snapd change installing them,
+        to follow with :meth:`get_change` or :meth:`wait_for_changes`.
+
+    Raises:
+        SnapError if snapd refuses the installation
+    """
+    return _submit_batch("install", snaps)
+
+
+def refresh_batch(snaps: Dict[str, Dict]) -> Dict[str, str]:
+    """Submit the refresh of several snaps to snapd without waiting for it.
+
+    See :meth:`install_batch` for the arguments and the returned changes.
+
+    Raises:
+        SnapError if snapd refuses the refresh
+    """
+    return _submit_batch("refresh", snaps)
+
+
+def hold_batch(snap_names: List[str], duration: Optional[timedelta] = None) -> None:
+    """Add a refresh hold to several snaps in a single snapd request.
+
+    Args:
+        snap_names: the names of the snaps to hold
+        duration: duration for the hold, or None (the default) to hold the snaps indefinitely.
+
+    Raises:
+        SnapError if snapd refuses the hold
+    """
+    hold_time = "forever"
+    if duration is not None:
+        hold_time = (datetime.now(timezone.utc) + duration).isoformat()
+    options = {"hold-level": "general", "time": hold_time}
+    try:
+        change_id = SnapClient().snaps_action("hold", snap_names, options)
+    except SnapAPIError as e:
+        raise SnapError("Could not hold snap(s) {}: {}".format(", ".join(snap_names), e.message))
+    wait_for_changes([change_id])
+
+
+def wait_for_changes(
+    change_ids: Iterable[str], timeout: float = 600.0, interval: float = 1.0
+) -> List[SnapChange]:
+    """Wait until snapd is done with the given changes.
+
+    Args:
+        change_ids: the IDs of the snapd changes to wait for
+        timeout: how long to wait for, in seconds. Default is 600s.
+        interval: how often to poll snapd, in seconds. Default is 1s.
+
+    Returns:
+        the finished changes, in the order of `change_ids`.
+
+    Raises:
+        SnapError if a change failed or did not finish in time
+    """
+    pending = list(dict.fromkeys(change_ids))
+    finished = {}
+    deadline = time.monotonic() + timeout
+    while pending:
+        for change_id in list(pending):
+            change = get_change(change_id)
+            if change.failed:
+                raise SnapError("snapd change {} failed: {}".format(change_id, change.err))
+            if change.ready:
+                finished[change_id] = change
+                pending.remove(change_id)
+        if pending:
+            if time.monotonic() > deadline:
+                raise SnapError("Timed out waiting for snapd change(s) {}".format(pending))
+            time.sleep(interval)
+    return list(finished.values())
+
+
 def _system_set(config_item: str, value: str) -> None:
     """Set system snapd config values.
 
@@ -2,153 +2,1218 @@
 # Copyright 2024 Canonical Ltd.
 # See LICENSE file for licensing details.
 
+"""Charm the juju-dns CoreDNS server.
+
+Heavy modules (jinja2, the snap library, platform) are imported inside the
+handlers that use them, so that hooks such as ``start`` only pay for ``ops``.
+"""
+
 import logging
-from jinja2 import Template
-import yaml
-import subprocess
-from constants import COREFILE_PATH, JUJU_DNS_SNAP_NAME, SNAP_PACKAGES,JUJU_DNS_PLUGIN_CONFIG_PATH
 import os
-import pwd
+import time
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
 import ops
-from ops.framework import StoredState
 from ops.charm import (
     ActionEvent,
-    RelationDepartedEvent,
     RelationEvent,
-    RelationJoinedEvent,
 )
-import platform
-from charms.operator_libs_linux.v2 import snap
+from ops.framework import StoredState
+
+import config
+from constants import (
+    CONFIG_EVENTS,
+    CONFIG_HISTORY_PATH,
+    CONTROLLER_LIMIT_OPTIONS,
+    CONTROLLER_PROBE_TIMEOUT,
+    COREFILE_PATH,
+    JUJU_DNS_PLUGIN_CONFIG_PATH,
+    JUJU_DNS_SNAP_NAME,
+    JUJU_DNS_ZONE,
+    LOADBALANCE_WEIGHTS_PATH,
+    METRICS_ADDRESS,
+    NODE_LOCAL_ADDRESS,
+    PROBE_DEADLINE,
+    QUERY_LOG_PATH,
+    READY_ADDRESS,
+    RESOLVED_DROPIN_PATH,
+    REVERSE_HOSTS_PATH,
+    SERVICE_DROPIN_PATH,
+    SNAP_PACKAGES,
+    SYSCTL_OPTIONS,
+    SYSCTL_PATH,
+)
 
 logger = logging.getLogger(__name__)
 
+
+class SnapInstalledEvent(ops.EventBase):
+    """Emitted once the asynchronous installation of the snaps is done."""
+
+
+class JujuDnsCharmEvents(ops.CharmEvents):
+    """Custom events of the juju-dns charm."""
+
+    snap_installed = ops.EventSource(SnapInstalledEvent)
+
+
 class JujuDnsCharm(ops.CharmBase):
+    on = JujuDnsCharmEvents()  # type: ignore
     _stored = StoredState()
-    controllers = {}
 
     def __init__(self, framework: ops.Framework):
         super().__init__(framework)
         framework.observe(self.on.start, self._on_start)
         framework.observe(self.on.install, self._on_install)
+        framework.observe(self.on.upgrade_charm, self._on_upgrade_charm)
+        framework.observe(self.on.update_status, self._on_update_status)
+        framework.observe(self.on.snap_installed, self._on_snap_installed)
         framework.observe(self.on.config_changed, self._on_config_changed)
         framework.observe(self.on["controller"].relation_joined, self._on_relation_joined)
-        self._stored.set_default(port=1053, ttl="60")
-        port=ops.Port('udp', 1053)
-        self.unit.set_ports(port)
-
+        framework.observe(self.on["controller"].relation_changed, self._on_relation_joined)
+        framework.observe(self.on["controller"].relation_departed, self._on_relation_joined)
+        for event in (
+            self.on["dns-endpoints"].relation_joined,
+            self.on["juju-dns-peers"].relation_joined,
+            self.on["juju-dns-peers"].relation_changed,
+            self.on["juju-dns-peers"].relation_departed,
+            self.on.leader_elected,
+        ):
+            framework.observe(event, self._on_endpoints_changed)
+        framework.observe(self.on["dns-upstream"].relation_changed, self._on_upstream_changed)
+        framework.observe(self.on["dns-upstream"].relation_broken, self._on_upstream_changed)
+        framework.observe(self.on.stats_action, self._on_stats_action)
+        framework.observe(self.on.warm_cache_action, self._on_warm_cache_action)
+        framework.observe(self.on.benchmark_action, self._on_benchmark_action)
+        framework.observe(self.on.query_log_action, self._on_query_log_action)
+        framework.observe(self.on.config_history_action, self._on_config_history_action)
+        self._stored.set_default(
+            port=1053,
+            config={},
+            install_changes={},
+            digests={},
+            query_log_cursor="",
+            health=[],
+            controller_addresses={},
+            config_events=[],
+            rollback="",
+            reverse={},
+            sysctl_defaults={},
+        )
 
     def _on_start(self, event: ops.StartEvent):
         """Handle start event."""
-        self.unit.status = ops.ActiveStatus()
+        if not self._stored.install_changes:
+            self.unit.status = self._ready_status()
 
     def _on_install(self, event: ops.InstallEvent):
         """Handle install event."""
+        from charms.operator_libs_linux.v2 import snap
+
         self.unit.status = ops.MaintenanceStatus("Installing juju-dns snap")
 
+        # The receive buffer size of the listener is set when CoreDNS opens it,
+        # so tune the kernel before the snap first starts.
+        try:
+            self._apply_sysctl(self._charm_config())
+        except config.ConfigError as e:
+            logger.warning("Not tuning the kernel: %s", e)
+
+        # Install every missing snap in one batch, rather than one snapd
+        # transaction after the other.
+        try:
+            snap_cache = snap.SnapCache()
+            missing = {
+                snap_name: _snap_options(snap_version)
+                for snap_name, snap_version in SNAP_PACKAGES
+                if not snap_cache[snap_name].present
+            }
+            if missing:
+                changes = snap.install_batch(missing)
+                logger.info("Installing snaps in snapd changes %s", changes)
+                if self.config["install-mode"] == "async":
+                    # Don't hold the hook until the download is done, follow the
+                    # snapd changes on update-status instead.
+                    self._stored.install_changes = changes
+                    self.unit.status = ops.MaintenanceStatus(
+                        "Waiting for the juju-dns snap download"
+                    )
+                    return
+                snap.wait_for_changes(changes.values())
+                pinned = [name for name, options in missing.items() if options.get("revision")]
+                if pinned:
+                    snap.hold_batch(pinned)
+        except (snap.SnapError, snap.SnapNotFoundError) as e:
+            logger.error("An exception occurred when installing snaps. Reason: %s", str(e))
+            raise
+
+        self.unit.status = ops.ActiveStatus("Ready")
+
+    def _on_update_status(self, event: ops.UpdateStatusEvent):
+        """Handle update-status event."""
+        if self._stored.install_changes:
+            self._check_install()
+            return
+        if self._stored.config.get("query-log-sample"):
+            self._collect_query_log()
+        reordered, failover = self._rank_controllers()
+        if reordered and self._render_config() and failover:
+            # Move the plugin off a controller API address that went down; a
+            # mere reorder is only written, for the next restart to pick up.
+            self._restart_snap()
+        if self._stored.config.get("reverse-names"):
+            self._refresh_reverse()
+        if isinstance(self.unit.status, (ops.ActiveStatus, ops.WaitingStatus)):
+            # Leave a blocked or in-progress unit's status alone.
+            self._check_health()
+        self._publish_endpoint()
+
+    def _check_health(self) -> None:
+        """Sample the resource usage of the juju-dns services and report it in the unit status."""
+        import subprocess
+
+        from charms.operator_libs_linux.v2 import snap
+
+        import health
+        import service
+
+        try:
+            pids = []
+            for name in snap.SnapCache()[JUJU_DNS_SNAP_NAME].services:
+                unit = service.unit_name(JUJU_DNS_SNAP_NAME, name)
+                pid = int(service.show(unit, ["MainPID"]).get("MainPID") or 0)
+                if pid:
+                    pids.append(pid)
+            samples = [health.sample(pid) for pid in pids]
+        except (snap.SnapError, OSError, ValueError, subprocess.CalledProcessError) as e:
+            logger.warning("Unable to sample the juju-dns services: %s", e)
+            return
+        if not pids:
+            self._stored.health = []
+            self.unit.status = ops.WaitingStatus("juju-dns service is not running")
+            return
+
+        current = {
+            "time": time.time(),
+            "pids": ",".join(map(str, pids)),
+            **{key: sum(sample[key] for sample in samples) for key in ("cpu", "rss", "sockets")},
+        }
+        # A restarted process starts a new window.
+        window = [dict(past) for past in self._stored.health if past["pids"] == current["pids"]]
+        window = (window + [current])[-health.WINDOW :]
+        self._stored.health = window
+
+        rss_mib = current["rss"] / (1024 * 1024)
+        cpu = health.cpu_percent(window)
+        usage = f"rss {rss_mib:.1f} MiB, cpu {cpu}%, {current['sockets']} sockets"
+
+        over = []
+        max_rss = self._stored.config.get("health-max-rss")
+        if max_rss and rss_mib > max_rss:
+            over.append(f"rss over {max_rss} MiB")
+        max_cpu = self._stored.config.get("health-max-cpu")
+        if max_cpu and cpu > max_cpu:
+            over.append(f"cpu over {max_cpu}%")
+        if over:
+            self.unit.status = ops.WaitingStatus(f"{usage} ({', '.join(over)})")
+        else:
+            self.unit.status = ops.ActiveStatus(usage)
+
+    def _check_install(self) -> None:
+        """Report the progress of the snapd install changes, and activate once they are done."""
+        from charms.operator_libs_linux.v2 import snap
+
+        done = total = 0
+        summaries = []
+        changes = {}
+        for snap_name, change_id in self._stored.install_changes.items():
+            # Snaps installed in the same multi-snap transaction share a change.
+            changes.setdefault(change_id, snap_name)
+        for change_id, snap_name in changes.items():
+            change = snap.get_change(change_id)
+            if change.failed:
+                logger.error("Installing snap %s failed: %s", snap_name, change.err)
+                self._stored.install_changes = {}
+                self.unit.status = ops.BlockedStatus(
+                    f"Installing {snap_name} failed: {change.err}"
+                )
+                return
+            if not change.ready:
+                done += change.done
+                total += change.total
+                summaries.append(change.summary)
+
+        if summaries:
+            progress = f"{done / total:.0%}" if total else "starting"
+            self.unit.status = ops.MaintenanceStatus(f"Installing: {progress} ({summaries[0]})")
+            return
+
+        self._stored.install_changes = {}
+        self.on.snap_installed.emit()
+
+    def _on_snap_installed(self, event: SnapInstalledEvent) -> None:
+        """Hold the pinned snaps and start serving once the installation is done."""
+        from charms.operator_libs_linux.v2 import snap
+
+        pinned = [name for name, snap_version in SNAP_PACKAGES if "revision" in snap_version]
+        if pinned:
+            snap.hold_batch(pinned)
+
+        self._render_corefile()
+        self._render_config()
+        self._apply_resource_controls()
+        self._restart_snap()
+        self._configure_resolved()
+        # The config may have become invalid, or rolled back, during the install.
+        self.unit.status = self._ready_status()
+        self._publish_endpoint()
+
+    def _on_upgrade_charm(self, event: ops.UpgradeCharmEvent) -> None:
+        """Refresh the snaps whose pinned revision changed, and apply the new templates."""
+        from charms.operator_libs_linux.v2 import snap
+
+        if self._stored.install_changes:
+            # The snaps are still being installed from the previous charm revision.
+            return
+
+        self.unit.status = ops.MaintenanceStatus("Upgrading juju-dns")
+        snap_cache = snap.SnapCache()
+        outdated = {}
         for snap_name, snap_version in SNAP_PACKAGES:
-            try:
-                snap_cache = snap.SnapCache()
-                snap_package = snap_cache[snap_name]
-
-                if not snap_package.present:
-                    if revision := snap_version.get("revision"):
-                        try:
-                            revision = revision[platform.machine()]
-                        except Exception:
-                            logger.error("Unavailable snap architecture %s", platform.machine())
-                            raise
-                        channel = snap_version.get("channel", "")
-                        snap_package.ensure(
-                            snap.SnapState.Latest, revision=revision, channel=channel
-                        )
-                        snap_package.hold()
-                    else:
-                        snap_package.ensure(snap.SnapState.Latest, channel=snap_version["channel"])
-            except (snap.SnapError, snap.SnapNotFoundError) as e:
-                logger.error(
-                    "An exception occurred when installing %s. Reason: %s", snap_name, str(e)
+            options = _snap_options(snap_version)
+            installed = snap_cache[snap_name]
+            if options.get("revision") and options["revision"] != installed.revision:
+                logger.info(
+                    "Refreshing snap %s from revision %s to %s",
+                    snap_name,
+                    installed.revision,
+                    options["revision"],
                 )
+                outdated[snap_name] = options
+
+        # Render before refreshing, so that the refreshed service starts with the
+        # new files and no extra restart is needed.
+        changed = self._render_corefile()
+        changed = self._render_config() or changed
+        if self._stored.config:
+            # The new charm may tune the kernel differently.
+            changed = self._apply_sysctl(self._stored.config) or changed
+        services = self._apply_resource_controls()
+
+        if outdated:
+            try:
+                snap.wait_for_changes(snap.refresh_batch(outdated).values())
+                snap.hold_batch(list(outdated))
+            except snap.SnapError as e:
+                logger.error("An exception occurred when refreshing snaps. Reason: %s", str(e))
                 raise
-        self.unit.status = ops.ActiveStatus("Ready")
+            if self._stored.config:
+                # The refresh restarted the service.
+                self._probe_restart(snap.SnapCache()[JUJU_DNS_SNAP_NAME])
+        elif changed:
+            self._restart_snap()
+        elif services:
+            self._restart_snap(services)
+        else:
+            logger.info("juju-dns is up to date, nothing to do")
+
+        self.unit.status = self._ready_status()
 
     def _on_config_changed(self, event: ops.ConfigChangedEvent):
         """Handle config changed event."""
+        try:
+            charm_config = self._charm_config()
+        except config.ConfigError as e:
+            logger.error("%s", e)
+            self.unit.status = ops.BlockedStatus(str(e))
+            return
 
-        # First open the port if it changed:
-        if self.config["port"] != self._stored.port:
-            self._stored.port = ops.Port('udp',self.config["port"])
-            port=ops.Port('udp', self._stored.port)
-            self.unit.set_ports(port)
-            # Dump Corefile with the updated port
-            self._render_corefile()
+        changed = charm_config.changes(self._stored.config)
+        artifacts = config.artifacts(changed)
+        logger.debug("Config changes %s, rebuilding %s", sorted(changed), sorted(artifacts))
+        self._stored.config = dict(charm_config)
 
-        # Update the ttl of the DNS records:
-        if self.config["ttl"] != self._stored.ttl:
-            self._stored.ttl = self.config["ttl"]
-            # Dump config yaml.
-            self._render_config()
+        if config.PORTS in artifacts:
+            self._stored.port = charm_config["port"]
+            if charm_config["mode"] == "node-local":
+                # Only served on loopback.
+                self.unit.set_ports()
+            else:
+                self.unit.set_ports(ops.Port("udp", self._stored.port))
+
+        self._apply_artifacts(charm_config, artifacts)
+
+        if not self._stored.install_changes:
+            self.unit.status = self._ready_status()
+        self._publish_endpoint()
+
+    def _apply_artifacts(self, charm_config: config.CharmConfig, artifacts: Set[str]) -> None:
+        """Rebuild the `artifacts` of a config change, restarting the service at most once."""
+        restart = False
+        if config.SYSCTL in artifacts:
+            # Only sockets opened after the change get the new buffer sizes.
+            restart = self._apply_sysctl(charm_config) and not self._stored.install_changes
+        if config.COREFILE in artifacts:
+            restart = self._render_corefile() or restart
+        if config.PLUGIN_CONFIG in artifacts:
+            restart = self._render_config() or restart
+        services = []
+        if config.SERVICE in artifacts:
+            services = self._apply_resource_controls()
+        if restart:
+            self._restart_snap()
+        elif services:
+            self._restart_snap(services)
+        if config.RESOLVED in artifacts:
+            self._configure_resolved()
+        if config.REVERSE in artifacts:
+            self._refresh_reverse()
+
+    def _ready_status(self) -> ops.StatusBase:
+        """Return the status of a unit done with its config: active, unless it can't serve a zone."""
+        try:
+            # The stored config is the last valid one, not necessarily the current one.
+            self._charm_config()
+        except config.ConfigError as e:
+            return ops.BlockedStatus(str(e))
+        conflict = self._watcher_conflict(self._controllers())
+        if conflict:
+            return ops.BlockedStatus(conflict)
+        if self._stored.rollback:
+            return ops.BlockedStatus(self._stored.rollback)
+        if self._stored.config.get("mode") == "node-local" and not self._upstreams():
+            return ops.BlockedStatus(
+                "mode node-local requires upstream-servers or a dns-upstream relation"
+            )
+        return ops.ActiveStatus()
+
+    def _charm_config(self) -> config.CharmConfig:
+        """Return the validated charm config.
+
+        Raises:
+            config.ConfigError: if an option has an invalid value.
+        """
+        return config.CharmConfig.load(self.config)
+
+    def _on_stats_action(self, event: ActionEvent) -> None:
+        """Report the query counters of the running CoreDNS server."""
+        import metrics
+
+        try:
+            samples = metrics.scrape(METRICS_ADDRESS)
+        except OSError as e:
+            event.fail(f"Unable to read CoreDNS metrics from {METRICS_ADDRESS}: {e}")
+            return
+
+        try:
+            udp = metrics.snmp_counters("Udp")
+        except OSError as e:
+            logger.warning("Unable to read the kernel UDP counters: %s", e)
+            udp = {}
+
+        denied = []
+        if self._stored.config.get("log-denials"):
+            import subprocess
+
+            import querylog
+
+            try:
+                denied = querylog.denied_clients()
+            except (OSError, subprocess.CalledProcessError) as e:
+                logger.warning("Unable to read the denied answers from the journal: %s", e)
+
+        event.set_results(
+            {
+                "services": self._resource_controls(),
+                "udp-receive-buffer-errors": udp.get("RcvbufErrors", 0),
+                "udp-receive-errors": udp.get("InErrors", 0),
+                "queries": metrics.total(samples, "coredns_dns_requests_total"),
+                "nxdomain-responses": metrics.total(
+                    samples, "coredns_dns_responses_total", rcode="NXDOMAIN"
+                ),
+                "denial-cache-hits": metrics.total(
+                    samples, "coredns_cache_hits_total", type="denial"
+                ),
+                "denied-clients": "\n".join(f"{count} {client}" for client, count in denied),
+            }
+        )
+
+    def _resource_controls(self) -> Dict[str, Dict[str, str]]:
+        """Return the effective resource controls of every juju-dns service."""
+        import subprocess
+
+        from charms.operator_libs_linux.v2 import snap
+
+        import service
 
-    def _on_relation_joined(self, event: RelationJoinedEvent) -> None:
+        controls = {}
+        try:
+            for name in snap.SnapCache()[JUJU_DNS_SNAP_NAME].services:
+                unit = service.unit_name(JUJU_DNS_SNAP_NAME, name)
+                properties = service.show(unit, service.EFFECTIVE_PROPERTIES)
+                controls[name] = {
+                    key: properties.get(prop, "")
+                    for prop, key in service.EFFECTIVE_PROPERTIES.items()
+                }
+        except (snap.SnapError, OSError, subprocess.CalledProcessError) as e:
+            logger.warning("Unable to read the juju-dns services resource controls: %s", e)
+        return controls
+
+    def _on_warm_cache_action(self, event: ActionEvent) -> None:
+        """Pre-resolve the known names through the local listener."""
+        try:
+            warm_names = self._charm_config()["warm-names"]
+        except config.ConfigError as e:
+            event.fail(str(e))
+            return
+        names = self._warm_names(warm_names) + event.params.get("names", "").split()
+        if not names:
+            event.fail("No names to warm: set the warm-names config option or the names param")
+            return
+        event.set_results(
+            self._warm_cache(names, event.params["concurrency"], event.params["timeout"])
+        )
+
+    def _on_benchmark_action(self, event: ActionEvent) -> None:
+        """Measure the throughput and latency of the local listener."""
+        import asyncio
+
+        import resolver
+
+        try:
+            warm_names = self._charm_config()["warm-names"]
+        except config.ConfigError as e:
+            event.fail(str(e))
+            return
+        names = event.params["names"].split() or self._warm_names(warm_names)
+        if not names:
+            event.fail("No names to query: set the names param or the warm-names config option")
+            return
+        try:
+            qtypes = [resolver.TYPES[qtype] for qtype in event.params["types"].upper().split()]
+        except KeyError as e:
+            event.fail(f"Unsupported query type {e}, use one of {', '.join(resolver.TYPES)}")
+            return
+
+        queries = [(name, qtype) for name in names for qtype in qtypes]
+        answers, elapsed = asyncio.run(
+            resolver.benchmark(
+                "127.0.0.1",
+                self._stored.port,
+                queries,
+                qps=event.params["qps"],
+                duration=event.params["duration"],
+                concurrency=event.params["concurrency"],
+                timeout=event.params["timeout"],
+                bufsize=event.params["edns-bufsize"],
+            )
+        )
+        event.set_results(resolver.summarize(answers, elapsed))
+
+    def _on_query_log_action(self, event: ActionEvent) -> None:
+        """Summarize the sampled queries kept on the unit."""
+        import querylog
+
+        if self._stored.config.get("query-log-sample"):
+            self._collect_query_log()
+        records = self._query_log().read()
+        if not records:
+            event.fail("No queries logged: set the query-log-sample config option")
+            return
+        event.set_results(querylog.summarize(records, event.params["top"]))
+
+    def _query_log(self):
+        """Return the ring buffer holding the sampled queries."""
+        import querylog
+
+        os.makedirs(QUERY_LOG_PATH, exist_ok=True)
+        max_bytes = self._stored.config.get("query-log-max-size", 0) * 1024 * 1024
+        return querylog.RingBuffer(QUERY_LOG_PATH, max_bytes)
+
+    def _collect_query_log(self) -> None:
+        """Move the queries logged to the journal since the last collection to the ring buffer."""
+        import subprocess
+
+        import querylog
+
+        try:
+            records, cursor = querylog.collect(self._stored.query_log_cursor)
+        except (OSError, subprocess.CalledProcessError) as e:
+            logger.warning("Unable to collect the query log: %s", e)
+            return
+        written = self._query_log().append(records)
+        self._stored.query_log_cursor = cursor or ""
+        logger.debug("Collected %d logged queries", written)
+
+    def _on_relation_joined(self, event: RelationEvent) -> None:
         """Update the controller address when joining the controller relation"""
-        for unit in event.relation.units:
-            if unit.app == "juju-dns":
-                # This is a peer unit
-                continue
-            controller_name = event.relation.data[unit]["controller_name"]
-            self.controllers[controller_name]={}
-            self.controllers[controller_name]["address"] = event.relation.data[unit]["address"]
-            self.controllers[controller_name]["username"] = event.relation.data[unit]["username"]
-            self.controllers[controller_name]["password"] = event.relation.data[unit]["password"]
         # Now that we have the address, also add the controller (model, because
         # this charm is supposed to be deployed on the controller model) name
         # to the config and render the file.
-        self._render_config()
+        self._rank_controllers()
+        restart = self._render_config()
+        if self._stored.config.get("shard-controllers"):
+            # The zone of a new controller may be forwarded to another unit.
+            restart = self._render_corefile() or restart
+        if restart:
+            self._restart_snap()
+        if self._stored.config and not self._stored.install_changes:
+            self.unit.status = self._ready_status()
+
+    def _on_endpoints_changed(self, event: ops.EventBase) -> None:
+        """Publish this unit's endpoint, and the server list when leading."""
+        self._publish_endpoint()
+        if self._stored.config.get("shard-controllers"):
+            # Units coming or going move controllers between the units.
+            restart = self._render_config()
+            restart = self._render_corefile() or restart
+            if restart:
+                self._restart_snap()
+
+    def _on_upstream_changed(self, event: RelationEvent) -> None:
+        """Forward a node-local unit to the servers published on the dns-upstream relation."""
+        if self._stored.config.get("mode") != "node-local":
+            return
+        if self._render_corefile():
+            self._restart_snap()
+        if not self._stored.install_changes:
+            self.unit.status = self._ready_status()
+
+    def _upstreams(self) -> List[str]:
+        """Return the servers a node-local unit forwards to, as host:port.
+
+        The upstream-servers option, when set, overrides the server list the
+        leader of the juju-dns servers publishes on the dns-upstream relation.
+        Every published server is used: CoreDNS health checks them itself.
+        """
+        if self._stored.config["upstream-servers"]:
+            return list(self._stored.config["upstream-servers"])
+        import json
+
+        upstreams = []
+        for relation in self.model.relations["dns-upstream"]:
+            if relation.app is None:
+                continue
+            try:
+                servers = json.loads(relation.data[relation.app].get("servers", "[]"))
+                upstreams += [f"{server['address']}:{server['port']}" for server in servers]
+            except (ValueError, TypeError, KeyError) as e:
+                logger.warning("Invalid server list from %s: %s", relation.app.name, e)
+        return upstreams
+
+    def _forwarded_controllers(self, names: Iterable[str]) -> Dict[str, str]:
+        """Return the endpoint of the unit owning each controller not owned by this one.
+
+        When sharding, each controller is owned by one of the units publishing an
+        endpoint on the peer relation; a unit only talks to the controllers it owns.
+        """
+        if not self._stored.config.get("shard-controllers"):
+            return {}
+        import sharding
+
+        endpoints = {}
+        peers = self.model.get_relation("juju-dns-peers")
+        if peers:
+            for unit in peers.units:
+                data = peers.data[unit]
+                if "address" in data:
+                    endpoints[unit.name] = f"{data['address']}:{data['port']}"
+        owners = sharding.assign(names, [self.unit.name, *endpoints])
+        return {name: endpoints[owner] for name, owner in owners.items() if owner in endpoints}
+
+    def _endpoint(self) -> Optional[Dict[str, str]]:
+        """Return how clients reach this unit, or None when it only serves its own machine."""
+        if self._stored.config.get("mode", "server") != "server":
+            return None
+        try:
+            binding = self.model.get_binding("dns-endpoints")
+            address = binding.network.ingress_address if binding else None
+        except ops.ModelError as e:
+            logger.warning("Unable to get the dns-endpoints address: %s", e)
+            return None
+        if address is None:
+            return None
+        return {
+            "address": str(address),
+            "port": str(self._stored.port),
+            "transports": "udp",
+            "health": self.unit.status.name,
+        }
+
+    def _publish_endpoint(self) -> None:
+        """Write this unit's endpoint to its databags, then refresh the server list.
+
+        Every unit publishes its own endpoint, so that clients see the units
+        come and go one at a time; the leader also publishes the whole list.
+        """
+        relations = self.model.relations["dns-endpoints"] + self.model.relations["juju-dns-peers"]
+        if not relations:
+            return
+        endpoint = self._endpoint() or {}
+        for relation in relations:
+            databag = relation.data[self.unit]
+            for key in ("address", "port", "transports", "health"):
+                value = endpoint.get(key)
+                if value is None:
+                    databag.pop(key, None)
+                elif databag.get(key) != value:
+                    databag[key] = value
+        if self.unit.is_leader():
+            self._publish_servers()
+
+    def _publish_servers(self) -> None:
+        """Publish the endpoints of every unit, as a JSON list, to the dns-endpoints relations."""
+        import json
+
+        peers = self.model.get_relation("juju-dns-peers")
+        units = sorted(peers.units | {self.unit}, key=lambda unit: unit.name) if peers else []
+        servers = []
+        for unit in units:
+            data = peers.data[unit]
+            if "address" not in data:
+                continue
+            servers.append(
+                {
+                    "unit": unit.name,
+                    "address": data["address"],
+                    "port": int(data["port"]),
+                    "transports": data["transports"].split(","),
+                    "health": data["health"],
+                }
+            )
+        published = json.dumps(servers, sort_keys=True)
+        for relation in self.model.relations["dns-endpoints"]:
+            if relation.data[self.app].get("servers") != published:
+                relation.data[self.app]["servers"] = published
+
+    def _controllers(self) -> dict:
+        """Return the address and credentials of every related controller, by name."""
+        controllers = {}
+        for relation in self.model.relations["controller"]:
+            for unit in relation.units:
+                if unit.app == self.app:
+                    # This is a peer unit
+                    continue
+                data = relation.data[unit]
+                if "controller_name" not in data:
+                    continue
+                # Every unit of an HA controller advertises its own API addresses.
+                controller = controllers.setdefault(data["controller_name"], {"addresses": []})
+                controller["username"] = data["username"]
+                controller["password"] = data["password"]
+                for address in data["address"].replace(",", " ").split():
+                    if address not in controller["addresses"]:
+                        controller["addresses"].append(address)
+
+        for name, controller in controllers.items():
+            # Closest first, as last ranked by `_rank_controllers`.
+            ranking = list(self._stored.controller_addresses.get(name, []))
+            controller["addresses"].sort(
+                key=lambda address: ranking.index(address) if address in ranking else len(ranking)
+            )
+            controller["address"] = controller["addresses"][0]
+        return controllers
+
+    def _rank_controllers(self) -> Tuple[bool, bool]:
+        """Probe the API addresses of every controller, and rank them by connect latency.
+
+        Returns:
+            whether the order of the addresses of a controller changed, and
+            whether that is because the first one went unreachable.
+        """
+        import asyncio
+
+        import probe
+
+        controllers = self._controllers()
+        for name in self._forwarded_controllers(controllers):
+            del controllers[name]
+        addresses = [a for controller in controllers.values() for a in controller["addresses"]]
+        if not addresses:
+            return False, False
+        latencies = asyncio.run(probe.probe(addresses, CONTROLLER_PROBE_TIMEOUT))
+
+        ranking = {}
+        for name, controller in controllers.items():
+            ranked = probe.rank(
+                {address: latencies[address] for address in controller["addresses"]},
+                controller["addresses"],
+            )
+            unreachable = [address for address in ranked if latencies[address] is None]
+            if unreachable:
+                logger.warning("Controller %s unreachable at %s", name, ", ".join(unreachable))
+            ranking[name] = ranked
+
+        previous = {
+            name: list(ranked) for name, ranked in self._stored.controller_addresses.items()
+        }
+        failover = any(
+            previous.get(name)
+            and previous[name][0] != ranked[0]
+            and latencies.get(previous[name][0]) is None
+            for name, ranked in ranking.items()
+        )
+        self._stored.controller_addresses = ranking
+        return ranking != previous, failover
+
+    def _watcher_conflict(self, controllers: dict) -> Optional[str]:
+        """Check that watch mode keeps exactly one watcher connection per controller.
+
+        A controller related twice, under two names, would be watched twice.
+
+        Returns:
+            why the controllers can't be watched, or None when they can.
+        """
+        if self._stored.config.get("resolution-mode") != "watch":
+            return None
+        watched = {}
+        for name in sorted(controllers):
+            for address in controllers[name]["addresses"]:
+                if address in watched:
+                    return (
+                        f"controllers {watched[address]} and {name} share the API address "
+                        f"{address}: only one watcher per controller"
+                    )
+                watched[address] = name
+        return None
+
+    def _warm_names(self, templates: list) -> list:
+        """Return the `warm-names` templates, expanded for every related controller."""
+        names = []
+        controllers = list(self._controllers())
+        for name in templates:
+            if "{controller}" in name:
+                names.extend(name.format(controller=controller) for controller in controllers)
+            else:
+                names.append(name)
+        return names
+
+    def _warm_cache(self, names: list, concurrency: int = 16, timeout: float = 2.0) -> dict:
+        """Resolve `names` against the local listener and report how it went."""
+        import asyncio
+
+        import resolver
+
+        port = self._stored.port
+        start = time.monotonic()
+        if not asyncio.run(resolver.wait_ready("127.0.0.1", port, JUJU_DNS_ZONE)):
+            logger.warning("juju-dns is not answering on port %s, warming anyway", port)
+        answers = asyncio.run(resolver.resolve_all("127.0.0.1", port, names, concurrency, timeout))
+        duration = time.monotonic() - start
+
+        warmed = [answer for answer in answers if answer.rcode != "TIMEOUT"]
+        logger.info("Warmed %d of %d names in %.2fs", len(warmed), len(names), duration)
+        return {
+            "names": len(names),
+            "warmed": len(warmed),
+            "timeouts": len(answers) - len(warmed),
+            "duration": round(duration, 3),
+            "latency-ms": resolver.percentiles([answer.latency for answer in warmed]),
+        }
 
     def _on_relation_handler(self, event: RelationEvent) -> None:
-        logger.info("*** relation handler:\n%s",event)
+        logger.info("*** relation handler:\n%s", event)
 
-    def _render_config(self) -> None:
-        """Render the juju-dns config file with the stored contents."""
+    def _render_config(self) -> bool:
+        """Render the juju-dns config file with the stored contents.
+
+        Returns:
+            whether the file changed, and the snap must be restarted.
+        """
+        if self._stored.install_changes or not self._stored.config:
+            # The snap is still being installed, or the config was never valid:
+            # everything is rendered once both are done.
+            return False
+        from jinja2 import Template
 
         # Load the config template.
         with open("templates/juju-dns-config.yaml.j2", "r") as file:
             template = Template(file.read())
 
-        config = template.render(
-            controllers=self.controllers,
-            ttl=self._stored.ttl
+        charm_config = self._stored.config
+        defaults = {option: charm_config[option] for option in CONTROLLER_LIMIT_OPTIONS}
+        overrides = charm_config["controller-limits"]
+        controllers = self._controllers()
+        for name in self._forwarded_controllers(controllers):
+            del controllers[name]
+        conflict = self._watcher_conflict(controllers)
+        if conflict:
+            logger.error("Not rendering %s: %s", JUJU_DNS_PLUGIN_CONFIG_PATH, conflict)
+            return False
+        for name, controller in controllers.items():
+            controller["limits"] = {**defaults, **overrides.get(name, {})}
+
+        plugin_config = template.render(
+            controllers=controllers,
+            limits=defaults,
+            ttl=charm_config["ttl"],
+            ttls={
+                record: charm_config[f"{record}-ttl"]
+                if charm_config[f"{record}-ttl"] is not None
+                else charm_config["ttl"]
+                for record in ("machine", "unit", "application")
+            },
+            negative_ttl=charm_config["negative-ttl"],
+            ttl_jitter=charm_config["ttl-jitter"],
+            resolution_mode=charm_config["resolution-mode"],
         )
 
-        with open(JUJU_DNS_PLUGIN_CONFIG_PATH, "w") as file:
-            file.write(config)
-        os.chmod(JUJU_DNS_PLUGIN_CONFIG_PATH, 0o640)
+        return self._write_file(JUJU_DNS_PLUGIN_CONFIG_PATH, plugin_config)
 
-        self._restart_snap()
+    def _render_corefile(self) -> bool:
+        """Render CoreDNS Corefile with the port value.
 
-    def _render_corefile(self) -> None:
-        """Render CoreDNS Corefile with the port value."""
+        Returns:
+            whether the file changed, and the snap must be restarted.
+        """
+        if self._stored.install_changes or not self._stored.config:
+            # The snap is still being installed, or the config was never valid:
+            # everything is rendered once both are done.
+            return False
+        from jinja2 import Template
+
+        import querylog
 
         # Load the config template.
         with open("templates/Corefile.j2", "r") as file:
             template = Template(file.read())
 
+        node_local = self._stored.config["mode"] == "node-local"
+        forwarded = {} if node_local else self._forwarded_controllers(self._controllers())
         corefile = template.render(
-            port=self._stored.port
+            forwarded={f"{name}.{JUJU_DNS_ZONE}": peer for name, peer in forwarded.items()},
+            zone=JUJU_DNS_ZONE if node_local else ".",
+            bind=NODE_LOCAL_ADDRESS if node_local else None,
+            upstreams=self._upstreams() if node_local else None,
+            port=self._stored.port,
+            metrics_address=METRICS_ADDRESS,
+            ready_address=READY_ADDRESS,
+            negative_ttl=self._stored.config["negative-ttl"],
+            log_denials=self._stored.config["log-denials"],
+            denial_format=querylog.DENIAL_FORMAT,
+            edns_bufsize=self._stored.config["edns-bufsize"],
+            minimal_responses=self._stored.config["minimal-responses"],
+            query_log_sample=self._stored.config["query-log-sample"],
+            query_log_format=querylog.LOG_FORMAT,
+            loadbalance=self._stored.config["loadbalance"],
+            loadbalance_weights_path=LOADBALANCE_WEIGHTS_PATH,
+            reverse_hosts_path=REVERSE_HOSTS_PATH
+            if self._stored.config["reverse-names"]
+            else None,
+            reverse_ttl=self._stored.config["ttl"],
         )
 
-        with open(COREFILE_PATH, "w") as file:
-            file.write(corefile)
-        os.chmod(COREFILE_PATH, 0o640)
+        weights = self._stored.config["loadbalance-weights"]
+        if weights:
+            # CoreDNS reloads the weights file by itself, no need to restart.
+            self._write_file(LOADBALANCE_WEIGHTS_PATH, _weights_file(weights))
 
-        self._restart_snap()
+        if self._stored.config["reverse-names"]:
+            # The hosts plugin reloads the map by itself, no need to restart.
+            import reverse
+
+            self._write_file(REVERSE_HOSTS_PATH, reverse.hosts_file(self._stored.reverse))
+
+        return self._write_file(COREFILE_PATH, corefile)
+
+    def _refresh_reverse(self) -> None:
+        """Resolve the reverse-names and rewrite the reverse map if their addresses changed."""
+        if self._stored.install_changes or not self._stored.config:
+            return
+        import asyncio
+
+        import resolver
+        import reverse
+
+        names = self._warm_names(self._stored.config["reverse-names"])
+        if not names:
+            self._stored.reverse = {}
+            return
+        answers = {
+            qtype: asyncio.run(
+                resolver.resolve_all("127.0.0.1", self._stored.port, names, qtype=qtype)
+            )
+            for qtype in (resolver.TYPE_A, resolver.TYPE_AAAA)
+        }
+        known = {name: list(addresses) for name, addresses in self._stored.reverse.items()}
+        self._stored.reverse = reverse.update(known, answers)
+        if self._write_file(REVERSE_HOSTS_PATH, reverse.hosts_file(self._stored.reverse)):
+            logger.info("Reverse map updated, %d names", len(self._stored.reverse))
+
+    def _configure_resolved(self) -> None:
+        """Point systemd-resolved at a node-local unit for the juju zone, or stop doing so."""
+        if self._stored.install_changes or not self._stored.config:
+            # Resolving through a unit that isn't serving yet would fail.
+            return
+        import subprocess
+
+        if self._stored.config["mode"] == "node-local":
+            from jinja2 import Template
+
+            with open("templates/resolved-juju.conf.j2", "r") as file:
+                template = Template(file.read())
+            dropin = template.render(
+                address=NODE_LOCAL_ADDRESS, port=self._stored.port, zone=JUJU_DNS_ZONE
+            )
+            os.makedirs(os.path.dirname(RESOLVED_DROPIN_PATH), exist_ok=True)
+            if not self._write_file(RESOLVED_DROPIN_PATH, dropin, mode=0o644):
+                return
+        elif os.path.exists(RESOLVED_DROPIN_PATH):
+            os.remove(RESOLVED_DROPIN_PATH)
+            self._stored.digests.pop(RESOLVED_DROPIN_PATH, None)
+        else:
+            return
+
+        try:
+            subprocess.run(
+                ["systemctl", "reload-or-restart", "systemd-resolved"],
+                capture_output=True,
+                check=True,
+            )
+        except (OSError, subprocess.CalledProcessError) as e:
+            logger.warning("Unable to restart systemd-resolved: %s", e)
+
+    def _apply_sysctl(self, charm_config) -> bool:
+        """Write the sysctl drop-in tuning the UDP receive path, and load it if it changed.
+
+        The kernel value of a setting is recorded before the charm first changes it,
+        and written back once its option returns to 0: removing it from the drop-in
+        alone would leave the raised value to every process on the machine.
 
-    def _restart_snap(self) -> None:
-        """Restart the juju-dns snap."""
+        Returns:
+            whether the settings changed.
+        """
+        from jinja2 import Template
+
+        with open("templates/juju-dns-sysctl.conf.j2", "r") as file:
+            template = Template(file.read())
+
+        settings = {
+            key: charm_config[option]
+            for option, key in SYSCTL_OPTIONS.items()
+            if charm_config[option]
+        }
+        defaults = self._stored.sysctl_defaults
+        for key in settings:
+            if key not in defaults:
+                value = _sysctl_value(key)
+                if value is not None:
+                    defaults[key] = value
+        restore = {key: value for key, value in defaults.items() if key not in settings}
+        if not self._write_file(SYSCTL_PATH, template.render(settings=settings), mode=0o644):
+            return False
+
+        _sysctl("-p", SYSCTL_PATH)
+        if restore and _sysctl("-w", *(f"{key}={value}" for key, value in restore.items())):
+            for key in restore:
+                del defaults[key]
+        return True
+
+    def _apply_resource_controls(self) -> List[str]:
+        """Write the systemd drop-in with the resource controls of every juju-dns service.
+
+        Returns:
+            the services whose resource controls changed, and must be restarted.
+        """
+        if self._stored.install_changes or not self._stored.config:
+            # Applied once the snap is installed and the config is valid.
+            return []
+        from charms.operator_libs_linux.v2 import snap
+        from jinja2 import Template
+
+        import service
+
+        with open("templates/juju-dns-service.conf.j2", "r") as file:
+            template = Template(file.read())
+
+        settings = {
+            setting: self._stored.config[option]
+            for option, setting in service.RESOURCE_CONTROLS.items()
+            if self._stored.config[option]
+        }
+        dropin = template.render(settings=settings)
+
+        changed = []
+        for name in snap.SnapCache()[JUJU_DNS_SNAP_NAME].services:
+            path = SERVICE_DROPIN_PATH.format(unit=service.unit_name(JUJU_DNS_SNAP_NAME, name))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            if self._write_file(path, dropin, mode=0o644):
+                changed.append(name)
+        if changed:
+            service.daemon_reload()
+        return changed
+
+    def _write_file(self, path: str, content: str, mode: int = 0o640) -> bool:
+        """Write `content` to `path`, unless it has the digest of what was last written there.
+
+        Returns:
+            whether the file was written.
+        """
+        import hashlib
+
+        digest = hashlib.sha256(content.encode()).hexdigest()
+        if self._stored.digests.get(path) == digest and os.path.exists(path):
+            logger.debug("%s is up to date", path)
+            return False
+
+        with open(path, "w") as file:
+            file.write(content)
+        os.chmod(path, mode)
+        self._stored.digests[path] = digest
+        return True
+
+    def _restart_snap(self, services: Optional[List[str]] = None) -> None:
+        """Restart the juju-dns snap, or only its given services, and check that it serves."""
+        from charms.operator_libs_linux.v2 import snap
 
         cache = snap.SnapCache()
         juju_dns_snap = cache[JUJU_DNS_SNAP_NAME]
 
+        if services is None and self._stored.rollback:
+            # The files on disk are a rolled back config, which a change to a few
+            # options would only partly replace: put the whole current config back.
+            self._render_corefile()
+            self._render_config()
+        juju_dns_snap.restart(services)
+        if self._stored.config:
+            self._probe_restart(juju_dns_snap)
+
+        if self._stored.config.get("warm-cache-on-restart"):
+            names = self._warm_names(self._stored.config["warm-names"])
+            if names:
+                self._warm_cache(names)
+
+    def _probe_restart(self, juju_dns_snap) -> None:
+        """Check that the restarted server is ready; if not, roll back to the last known-good config.
+
+        The probe is the CoreDNS ready plugin, so that a slow controller API doesn't
+        fail a good config. A config set that is ready is recorded as known good,
+        under CONFIG_HISTORY_PATH.
+        """
+        import history
+        import metrics
+
+        paths = [COREFILE_PATH, JUJU_DNS_PLUGIN_CONFIG_PATH]
+        os.makedirs(CONFIG_HISTORY_PATH, exist_ok=True)
+        configs = history.ConfigHistory(
+            CONFIG_HISTORY_PATH, self._stored.config.get("config-history-size", 5)
+        )
+
+        def answering() -> bool:
+            return metrics.wait_ready(READY_ADDRESS, PROBE_DEADLINE)
+
+        if answering():
+            self._record_config(configs.save(paths), "good")
+            self._stored.rollback = ""
+            return
+
+        failed = configs.digest(paths)
+        self._record_config(failed, "failed")
+        if failed in configs.digests():
+            # The files are known good, what broke is elsewhere: the service
+            # drop-in, or the refreshed snap.
+            logger.error("juju-dns is not ready with the known-good config %s", failed)
+            self._stored.rollback = f"juju-dns is not ready with known-good config {failed[:12]}"
+            return
+        known_good = [digest for digest in configs.digests() if digest != failed]
+        if not known_good:
+            logger.error("juju-dns is not answering, and there is no config to roll back to")
+            self._stored.rollback = f"config {failed[:12]} failed, no known-good config"
+            return
+
+        logger.error("juju-dns is not answering, rolling back to config %s", known_good[0])
+        configs.restore(known_good[0], paths)
+        for path in paths:
+            # Rendering the failed config again must rewrite the files.
+            self._stored.digests.pop(path, None)
         juju_dns_snap.restart()
+        rolled_back = answering()
+        self._record_config(known_good[0], "rolled-back" if rolled_back else "failed")
+        self._stored.rollback = (
+            f"config {failed[:12]} failed, rolled back to {known_good[0][:12]}"
+            if rolled_back
+            else f"config {failed[:12]} failed, rollback to {known_good[0][:12]} failed"
+        )
+
+    def _record_config(self, digest: str, result: str) -> None:
+        """Append to the config history shown by the config-history action."""
+        events = list(self._stored.config_events) + [
+            {"time": time.time(), "digest": digest, "result": result}
+        ]
+        self._stored.config_events = [dict(event) for event in events[-CONFIG_EVENTS:]]
+
+    def _on_config_history_action(self, event: ActionEvent) -> None:
+        """Report the known-good config sets and the recent restarts and rollbacks."""
+        import history
+
+        configs = history.ConfigHistory(CONFIG_HISTORY_PATH, 0)
+        event.set_results(
+            {
+                "current": configs.digest([COREFILE_PATH, JUJU_DNS_PLUGIN_CONFIG_PATH]),
+                "known-good": "\n".join(configs.digests()),
+                "events": "\n".join(
+                    "{} {} {}".format(
+                        time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(entry["time"])),
+                        entry["digest"],
+                        entry["result"],
+                    )
+                    for entry in self._stored.config_events
+                ),
+                "rollback": self._stored.rollback or "none",
+            }
+        )
+
+
+def _sysctl(*args: str) -> bool:
+    """Run sysctl with `args`, and return whether it succeeded."""
+    import subprocess
+
+    try:
+        subprocess.run(["sysctl", *args], capture_output=True, check=True)
+    except (OSError, subprocess.CalledProcessError) as e:
+        # Containers usually can't change net.core settings: keep running
+        # with the host's.
+        stderr = getattr(e, "stderr", b"") or b""
+        logger.warning(
+            "Unable to run sysctl %s: %s %s", " ".join(args), e, stderr.decode().strip()
+        )
+        return False
+    return True
+
+
+def _sysctl_value(key: str, proc: str = "/proc/sys") -> Optional[str]:
+    """Return the current value of the kernel setting `key`, or None if it can't be read."""
+    try:
+        with open(os.path.join(proc, *key.split("."))) as setting:
+            return " ".join(setting.read().split())
+    except OSError:
+        return None
+
+
+def _weights_file(weights: dict) -> str:
+    """Format the weights of the loadbalance plugin: each name, then its addresses and weights."""
+    lines = []
+    for name, addresses in weights.items():
+        lines.append(name)
+        lines.extend(f"{address} {weight}" for address, weight in addresses.items())
+    return "\n".join(lines) + "\n"
+
+
+def _snap_options(snap_version: dict) -> dict:
+    """Return the channel and this architecture's pinned revision of a SNAP_PACKAGES entry."""
+    import platform
+
+    options = {}
+    if channel := snap_version.get("channel"):
+        options["channel"] = channel
+    if revisions := snap_version.get("revision"):
+        try:
+            options["revision"] = revisions[platform.machine()]
+        except KeyError:
+            logger.error("Unavailable snap architecture %s", platform.machine())
+            raise
+    return options
+
 
 if __name__ == "__main__":  # pragma: nocover
     ops.main(JujuDnsCharm)  # type: ignore
@@ -0,0 +1,326 @@
+# Copyright 2024 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Typed model of the charm config.
+
+Every option is declared once in `OPTIONS`, with the parser that validates and
+converts it and the artifacts that must be rebuilt when it changes. The table is
+built at import time, so a hook only runs the parsers.
+"""
+
+import re
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, FrozenSet, Iterable, List, Mapping, Optional, Set
+
+from constants import CONTROLLER_LIMIT_OPTIONS
+
+# What an option change must be applied to.
+PORTS = "ports"
+COREFILE = "corefile"
+PLUGIN_CONFIG = "plugin-config"
+SYSCTL = "sysctl"
+SERVICE = "service"
+RESOLVED = "resolved"
+REVERSE = "reverse"
+
+
+class ConfigError(ValueError):
+    """Raised when an option has an invalid value."""
+
+
+@dataclass(frozen=True)
+class Option:
+    """A charm config option: its parser and the artifacts that depend on it."""
+
+    name: str
+    parse: Callable[[Any], Any]
+    artifacts: FrozenSet[str] = frozenset()
+
+
+def positive_int(value) -> int:
+    """Parse an integer greater than zero."""
+    if isinstance(value, bool) or not isinstance(value, int) or value <= 0:
+        raise ConfigError(f"must be a positive integer, got {value!r}")
+    return value
+
+
+def non_negative_int(value) -> int:
+    """Parse an integer greater than or equal to zero."""
+    if isinstance(value, bool) or not isinstance(value, int) or value < 0:
+        raise ConfigError(f"must be zero or a positive integer, got {value!r}")
+    return value
+
+
+def port_number(value) -> int:
+    """Parse a TCP/UDP port number."""
+    if isinstance(value, bool) or not isinstance(value, int) or not 1 <= value <= 65535:
+        raise ConfigError(f"must be a port number between 1 and 65535, got {value!r}")
+    return value
+
+
+def int_range(low: int, high: int) -> Callable[[Any], int]:
+    """Return a parser accepting an integer between `low` and `high`, inclusive."""
+
+    def parse(value) -> int:
+        if isinstance(value, bool) or not isinstance(value, int) or not low <= value <= high:
+            raise ConfigError(f"must be an integer between {low} and {high}, got {value!r}")
+        return value
+
+    return parse
+
+
+_WEIGHT = int_range(1, 255)
+
+_DURATION = re.compile(r"^\s*(\d+)\s*(s|m|h)?\s*$")
+_DURATION_UNITS = {None: 1, "s": 1, "m": 60, "h": 3600}
+
+
+def duration(value) -> int:
+    """Parse a duration such as "60", "30s", "5m" or "1h" into seconds."""
+    match = _DURATION.match(str(value))
+    if not match:
+        raise ConfigError(f'must be a duration such as "60", "30s" or "5m", got {value!r}')
+    return int(match.group(1)) * _DURATION_UNITS[match.group(2)]
+
+
+def optional_duration(value) -> Optional[int]:
+    """Parse an empty string as None, anything else as a `duration`."""
+    if not str(value).strip():
+        return None
+    return duration(value)
+
+
+def boolean(value) -> bool:
+    """Parse a boolean."""
+    if not isinstance(value, bool):
+        raise ConfigError(f"must be true or false, got {value!r}")
+    return value
+
+
+def words(value) -> List[str]:
+    """Parse a space separated list."""
+    return str(value).split()
+
+
+def pattern(regex: str, description: str) -> Callable[[Any], str]:
+    """Return a parser accepting an empty string, or a string matching `regex`."""
+    compiled = re.compile(regex)
+
+    def parse(value) -> str:
+        value = str(value).strip()
+        if value and not compiled.fullmatch(value):
+            raise ConfigError(f"must be {description}, got {value!r}")
+        return value
+
+    return parse
+
+
+def choice(*choices: str) -> Callable[[Any], str]:
+    """Return a parser accepting one of `choices`."""
+
+    def parse(value) -> str:
+        if value not in choices:
+            raise ConfigError(f"must be one of {', '.join(choices)}, got {value!r}")
+        return value
+
+    return parse
+
+
+def controller_limits(value) -> Dict[str, Dict[str, int]]:
+    """Parse the YAML mapping of controller names to controller API limits."""
+    import yaml
+
+    try:
+        overrides = yaml.safe_load(value) or {}
+    except yaml.YAMLError as e:
+        raise ConfigError(f"is not valid YAML: {e}") from None
+    if not isinstance(overrides, dict):
+        raise ConfigError("must map controller names to limits")
+
+    controllers = {}
+    for name, limits in overrides.items():
+        if not isinstance(limits, dict):
+            raise ConfigError(f"{name} must be a mapping")
+        unknown = set(limits) - set(CONTROLLER_LIMIT_OPTIONS)
+        if unknown:
+            raise ConfigError(f"{name}: unknown {', '.join(sorted(unknown))}")
+        try:
+            controllers[str(name)] = {
+                option: _OPTIONS_BY_NAME[option].parse(value) for option, value in limits.items()
+            }
+        except ConfigError as e:
+            raise ConfigError(f"{name}: {e}") from None
+    return controllers
+
+
+_ENDPOINT = re.compile(r"(\[[0-9a-fA-F:.]+\]|[A-Za-z0-9.-]+)(?::(\d+))?")
+
+
+def endpoints(value) -> List[str]:
+    """Parse a space separated list of DNS servers, "host[:port]", defaulting to port 1053."""
+    servers = []
+    for endpoint in str(value).split():
+        match = _ENDPOINT.fullmatch(endpoint)
+        if not match:
+            raise ConfigError(f"must be host[:port] DNS servers, got {endpoint!r}")
+        host, port = match.group(1), port_number(int(match.group(2) or 1053))
+        servers.append(f"{host}:{port}")
+    return servers
+
+
+def loadbalance_weights(value) -> Dict[str, Dict[str, int]]:
+    """Parse the YAML mapping of names to the weight of each of their addresses."""
+    import ipaddress
+
+    import yaml
+
+    try:
+        weights = yaml.safe_load(value) or {}
+    except yaml.YAMLError as e:
+        raise ConfigError(f"is not valid YAML: {e}") from None
+    if not isinstance(weights, dict):
+        raise ConfigError("must map names to address weights")
+
+    names = {}
+    for name, addresses in weights.items():
+        if not isinstance(addresses, dict) or not addresses:
+            raise ConfigError(f"{name} must map addresses to weights")
+        try:
+            names[str(name).rstrip(".")] = {
+                str(ipaddress.ip_address(address)): _WEIGHT(weight)
+                for address, weight in addresses.items()
+            }
+        except ValueError as e:
+            raise ConfigError(f"{name}: {e}") from None
+    return names
+
+
+OPTIONS = (
+    Option("install-mode", choice("blocking", "async")),
+    Option("mode", choice("server", "node-local"), frozenset({PORTS, COREFILE, RESOLVED})),
+    Option("upstream-servers", endpoints, frozenset({COREFILE})),
+    Option("port", port_number, frozenset({PORTS, COREFILE, RESOLVED})),
+    Option("ttl", duration, frozenset({PLUGIN_CONFIG})),
+    Option("machine-ttl", optional_duration, frozenset({PLUGIN_CONFIG})),
+    Option("unit-ttl", optional_duration, frozenset({PLUGIN_CONFIG})),
+    Option("application-ttl", optional_duration, frozenset({PLUGIN_CONFIG})),
+    Option("ttl-jitter", int_range(0, 50), frozenset({PLUGIN_CONFIG})),
+    Option("max-concurrent-requests", positive_int, frozenset({PLUGIN_CONFIG})),
+    Option("connection-pool-size", positive_int, frozenset({PLUGIN_CONFIG})),
+    Option("request-timeout", positive_int, frozenset({PLUGIN_CONFIG})),
+    Option("cache-ttl", positive_int, frozenset({PLUGIN_CONFIG})),
+    Option("max-answers", non_negative_int, frozenset({PLUGIN_CONFIG})),
+    Option("controller-limits", controller_limits, frozenset({PLUGIN_CONFIG})),
+    Option("shard-controllers", boolean, frozenset({COREFILE, PLUGIN_CONFIG})),
+    Option("resolution-mode", choice("on-demand", "watch"), frozenset({PLUGIN_CONFIG})),
+    Option("negative-ttl", non_negative_int, frozenset({COREFILE, PLUGIN_CONFIG})),
+    Option("log-denials", boolean, frozenset({COREFILE})),
+    Option("edns-bufsize", int_range(512, 4096), frozenset({COREFILE})),
+    Option("minimal-responses", boolean, frozenset({COREFILE})),
+    Option("loadbalance", choice("off", "round_robin", "weighted"), frozenset({COREFILE})),
+    Option("loadbalance-weights", loadbalance_weights, frozenset({COREFILE})),
+    Option("rmem-max", non_negative_int, frozenset({SYSCTL})),
+    Option("netdev-max-backlog", non_negative_int, frozenset({SYSCTL})),
+    Option("udp-receive-buffer", non_negative_int, frozenset({SYSCTL})),
+    Option("cpu-quota", pattern(r"\d+%", 'a percentage such as "50%"'), frozenset({SERVICE})),
+    Option(
+        "cpu-affinity",
+        pattern(r"\d+(-\d+)?(,\d+(-\d+)?)*", 'a list of CPUs such as "0-1,3"'),
+        frozenset({SERVICE}),
+    ),
+    Option(
+        "memory-max",
+        pattern(r"\d+[KMGT]?|\d+%", 'a size such as "512M" or a percentage'),
+        frozenset({SERVICE}),
+    ),
+    Option("io-weight", int_range(0, 10000), frozenset({SERVICE})),
+    Option("nice", int_range(-20, 19), frozenset({SERVICE})),
+    Option("health-max-rss", non_negative_int),
+    Option("health-max-cpu", non_negative_int),
+    Option("query-log-sample", non_negative_int, frozenset({COREFILE})),
+    Option("query-log-max-size", positive_int),
+    Option("config-history-size", positive_int),
+    Option("reverse-names", words, frozenset({COREFILE, REVERSE})),
+    Option("warm-names", words),
+    Option("warm-cache-on-restart", boolean),
+)
+
+_OPTIONS_BY_NAME = {option.name: option for option in OPTIONS}
+
+
+def _check_pool_sizes(values: Dict[str, Any]) -> None:
+    """Check that no connection pool is larger than the allowed concurrency."""
+    defaults = {option: values[option] for option in CONTROLLER_LIMIT_OPTIONS}
+    for name, overrides in [(None, {}), *values["controller-limits"].items()]:
+        limits = {**defaults, **overrides}
+        if limits["connection-pool-size"] > limits["max-concurrent-requests"]:
+            scope = f"controller-limits {name}: " if name else ""
+            raise ConfigError(f"{scope}connection-pool-size exceeds max-concurrent-requests")
+
+
+def _check_ttl_jitter(values: Dict[str, Any]) -> None:
+    """Check that the jitter can't bring a TTL of a second or more down to zero."""
+    if not values["ttl-jitter"]:
+        return
+    for option in ("ttl", "machine-ttl", "unit-ttl", "application-ttl"):
+        ttl = values[option]
+        if ttl and ttl * (100 - values["ttl-jitter"]) < 100:
+            raise ConfigError(f"ttl-jitter {values['ttl-jitter']}% would expire {option} at once")
+
+
+def _check_loadbalance_weights(values: Dict[str, Any]) -> None:
+    """Check that weighted load balancing has weights to use."""
+    if values["loadbalance"] == "weighted" and not values["loadbalance-weights"]:
+        raise ConfigError("loadbalance weighted requires loadbalance-weights")
+
+
+class CharmConfig(Mapping):
+    """The validated charm config, keyed by option name."""
+
+    def __init__(self, values: Dict[str, Any]):
+        self._values = values
+
+    @classmethod
+    def load(cls, raw: Mapping[str, Any]) -> "CharmConfig":
+        """Parse and validate the raw charm config.
+
+        Raises:
+            ConfigError: naming the first invalid option and why it is invalid.
+        """
+        values = {}
+        for option in OPTIONS:
+            try:
+                values[option.name] = option.parse(raw[option.name])
+            except ConfigError as e:
+                raise ConfigError(f"invalid config: {option.name} {e}") from None
+        try:
+            _check_pool_sizes(values)
+            _check_loadbalance_weights(values)
+            _check_ttl_jitter(values)
+        except ConfigError as e:
+            raise ConfigError(f"invalid config: {e}") from None
+        return cls(values)
+
+    def __getitem__(self, name: str) -> Any:
+        """Return the parsed value of an option."""
+        return self._values[name]
+
+    def __iter__(self):
+        """Iterate over the option names."""
+        return iter(self._values)
+
+    def __len__(self) -> int:
+        """Report the number of options."""
+        return len(self._values)
+
+    def changes(self, previous: Mapping[str, Any]) -> Set[str]:
+        """Return the names of the options whose value differs from `previous`."""
+        return {name for name, value in self._values.items() if previous.get(name) != value}
+
+
+def artifacts(changed: Iterable[str]) -> Set[str]:
+    """Return the artifacts to rebuild for a set of changed options."""
+    result = set()
+    for name in changed:
+        result |= _OPTIONS_BY_NAME[name].artifacts
+    return result
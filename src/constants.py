@@ -1,6 +1,7 @@
 SNAP_COMMON_PATH = "/var/snap/juju-dns/common"
 JUJU_DNS_PLUGIN_CONFIG_PATH = f"{SNAP_COMMON_PATH}/juju-dns-config.yaml"
 COREFILE_PATH = f"{SNAP_COMMON_PATH}/Corefile"
+LOADBALANCE_WEIGHTS_PATH = f"{SNAP_COMMON_PATH}/loadbalance-weights"
 JUJU_DNS_SNAP_NAME = "juju-dns"
 SNAP_PACKAGES = [
     (
@@ -8,3 +9,43 @@ SNAP_PACKAGES = [
         {"revision": {"aarch64": "5", "x86_64": "6"}},
     )
 ]
+# Charm config options limiting the load the plugin puts on each controller API,
+# which can be overridden per controller with the `controller-limits` option.
+CONTROLLER_LIMIT_OPTIONS = (
+    "max-concurrent-requests",
+    "connection-pool-size",
+    "request-timeout",
+    "cache-ttl",
+    "max-answers",
+)
+# How long, in seconds, to wait for a TCP connection to a controller API address.
+CONTROLLER_PROBE_TIMEOUT = 1.0
+# Local-only CoreDNS prometheus listener, scraped by the stats action.
+METRICS_ADDRESS = "127.0.0.1:9153"
+# Local-only CoreDNS ready plugin listener, probed after every restart.
+READY_ADDRESS = "127.0.0.1:8181"
+# The zone served by the juju plugin.
+JUJU_DNS_ZONE = "juju.local"
+# systemd-resolved drop-in sending the JUJU_DNS_ZONE queries to a node-local unit.
+RESOLVED_DROPIN_PATH = "/etc/systemd/resolved.conf.d/juju.conf"
+# The loopback address a node-local unit listens on.
+NODE_LOCAL_ADDRESS = "127.0.0.1"
+# Ring buffer of the sampled query log.
+QUERY_LOG_PATH = f"{SNAP_COMMON_PATH}/query-log"
+# Addresses of the reverse-names, served as PTR records by the hosts plugin.
+REVERSE_HOSTS_PATH = f"{SNAP_COMMON_PATH}/reverse-hosts"
+# Kernel settings of the UDP receive path, keyed by the charm option managing them.
+SYSCTL_OPTIONS = {
+    "rmem-max": "net.core.rmem_max",
+    "netdev-max-backlog": "net.core.netdev_max_backlog",
+    "udp-receive-buffer": "net.core.rmem_default",
+}
+SYSCTL_PATH = "/etc/sysctl.d/60-juju-dns.conf"
+# systemd drop-in of a juju-dns snap service unit.
+SERVICE_DROPIN_PATH = "/etc/systemd/system/{unit}.d/60-juju-dns.conf"
+# Known-good sets of rendered config files, to roll back to.
+CONFIG_HISTORY_PATH = f"{SNAP_COMMON_PATH}/config-history"
+# How many config restarts and rollbacks the config-history action reports.
+CONFIG_EVENTS = 20
+# How long, in seconds, a restarted server has to report ready before being rolled back.
+PROBE_DEADLINE = 10.0
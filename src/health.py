@@ -0,0 +1,55 @@
+# Copyright 2024 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Resource usage of the CoreDNS process, read from /proc."""
+
+import os
+from typing import Dict, List
+
+# How many samples, one per update-status, the rolling window keeps.
+WINDOW = 6
+
+_CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+
+
+def sample(pid: int, proc: str = "/proc") -> Dict[str, float]:
+    """Return the CPU time (seconds), resident memory (bytes) and open sockets of `pid`.
+
+    Raises:
+        OSError: if the process is gone.
+    """
+    with open(f"{proc}/{pid}/stat") as stat:
+        # The command name may hold spaces: the fields start after its ")".
+        fields = stat.read().rpartition(")")[2].split()
+    # utime and stime, fields 14 and 15 of proc(5), are the 12th and 13th after the name.
+    cpu = (int(fields[11]) + int(fields[12])) / _CLOCK_TICKS
+
+    rss = 0
+    with open(f"{proc}/{pid}/status") as status:
+        for line in status:
+            if line.startswith("VmRSS:"):
+                rss = int(line.split()[1]) * 1024
+                break
+
+    sockets = 0
+    fd_dir = f"{proc}/{pid}/fd"
+    for fd in os.listdir(fd_dir):
+        try:
+            if os.readlink(f"{fd_dir}/{fd}").startswith("socket:"):
+                sockets += 1
+        except OSError:
+            # Closed since it was listed.
+            continue
+    return {"cpu": cpu, "rss": rss, "sockets": sockets}
+
+
+def cpu_percent(window: List[Dict[str, float]]) -> float:
+    """Return the average CPU usage over the samples of `window`, in percent of one CPU."""
+    if len(window) < 2:
+        return 0.0
+    first, last = window[0], window[-1]
+    elapsed = last["time"] - first["time"]
+    if elapsed <= 0 or last["cpu"] < first["cpu"]:
+        # Restarted process, or clock going backwards.
+        return 0.0
+    return round(100 * (last["cpu"] - first["cpu"]) / elapsed, 1)
@@ -0,0 +1,81 @@
+# Copyright 2024 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Known-good sets of rendered config files, kept to roll back a broken config.
+
+A set is the content of every config file of the juju-dns service, stored
+under a directory named after its digest. The `index` file lists the digests
+of the sets, the most recently known good first.
+"""
+
+import hashlib
+import os
+import shutil
+from typing import List, Sequence
+
+
+class ConfigHistory:
+    """The last `size` known-good config sets, under `directory`."""
+
+    def __init__(self, directory: str, size: int):
+        self.directory = directory
+        self.size = size
+        self._index = os.path.join(directory, "index")
+
+    @staticmethod
+    def digest(paths: Sequence[str]) -> str:
+        """Return the digest of the set made of the current content of `paths`."""
+        sha = hashlib.sha256()
+        for path in paths:
+            sha.update(os.path.basename(path).encode() + b"\0")
+            try:
+                with open(path, "rb") as file:
+                    sha.update(file.read())
+            except FileNotFoundError:
+                pass
+            sha.update(b"\0")
+        return sha.hexdigest()
+
+    def digests(self) -> List[str]:
+        """Return the digests of the known-good sets, the most recent first."""
+        try:
+            with open(self._index) as index:
+                return index.read().split()
+        except FileNotFoundError:
+            return []
+
+    def save(self, paths: Sequence[str]) -> str:
+        """Record the current content of `paths` as known good, and return its digest."""
+        digest = self.digest(paths)
+        target = os.path.join(self.directory, digest)
+        if not os.path.isdir(target):
+            staging = f"{target}.tmp"
+            shutil.rmtree(staging, ignore_errors=True)
+            os.makedirs(staging)
+            for path in paths:
+                if os.path.exists(path):
+                    shutil.copy2(path, staging)
+            os.replace(staging, target)
+
+        digests = [digest] + [known for known in self.digests() if known != digest]
+        for dropped in digests[self.size :]:
+            shutil.rmtree(os.path.join(self.directory, dropped), ignore_errors=True)
+        self._write_index(digests[: self.size])
+        return digest
+
+    def restore(self, digest: str, paths: Sequence[str]) -> None:
+        """Put back the content of `paths` from the set `digest`, replacing each file atomically."""
+        source = os.path.join(self.directory, digest)
+        for path in paths:
+            saved = os.path.join(source, os.path.basename(path))
+            if not os.path.exists(saved):
+                continue
+            staging = f"{path}.rollback"
+            shutil.copy2(saved, staging)
+            os.replace(staging, path)
+
+    def _write_index(self, digests: List[str]) -> None:
+        staging = f"{self._index}.tmp"
+        with open(staging, "w") as index:
+            index.write("\n".join(digests) + "\n")
+        os.replace(staging, self._index)
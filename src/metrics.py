@@ -0,0 +1,76 @@
+# Copyright 2024 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Read counters from the CoreDNS prometheus endpoint, and its readiness."""
+
+import re
+from typing import Dict, List, Tuple
+
+Sample = Tuple[str, Dict[str, str], float]
+
+_SAMPLE = re.compile(
+    r"^(?P<name>[a-zA-Z_:][a-zA-Z0-9_:]*)(?:\{(?P<labels>.*)\})?\s+(?P<value>\S+)"
+)
+_LABEL = re.compile(r'(\w+)="((?:[^"\\]|\\.)*)"')
+
+
+def parse(text: str) -> List[Sample]:
+    """Parse the prometheus text exposition format into (name, labels, value) samples."""
+    samples = []
+    for line in text.splitlines():
+        if not line or line.startswith("#"):
+            continue
+        match = _SAMPLE.match(line)
+        if not match:
+            continue
+        labels = dict(_LABEL.findall(match.group("labels") or ""))
+        samples.append((match.group("name"), labels, float(match.group("value"))))
+    return samples
+
+
+def scrape(address: str, timeout: float = 5.0) -> List[Sample]:
+    """Fetch and parse the metrics served at `address` (host:port)."""
+    import urllib.request
+
+    with urllib.request.urlopen(f"http://{address}/metrics", timeout=timeout) as response:
+        return parse(response.read().decode())
+
+
+def wait_ready(address: str, deadline: float = 10.0) -> bool:
+    """Poll the ready plugin at `address` (host:port) until it reports ready, for up to `deadline` seconds."""
+    import time
+    import urllib.request
+
+    end = time.monotonic() + deadline
+    while True:
+        try:
+            with urllib.request.urlopen(f"http://{address}/ready", timeout=0.5) as response:
+                if response.status == 200:
+                    return True
+        except OSError:
+            # Not listening yet, or some plugin not ready (503).
+            pass
+        if time.monotonic() >= end:
+            return False
+        time.sleep(0.2)
+
+
+def total(samples: List[Sample], name: str, **labels: str) -> int:
+    """Sum the samples of metric `name` whose labels include `labels`."""
+    return int(
+        sum(
+            value
+            for sample_name, sample_labels, value in samples
+            if sample_name == name and labels.items() <= sample_labels.items()
+        )
+    )
+
+
+def snmp_counters(protocol: str, path: str = "/proc/net/snmp") -> Dict[str, int]:
+    """Return the kernel counters of `protocol` ("Udp", "Tcp"...) from /proc/net/snmp."""
+    with open(path) as snmp:
+        rows = [line.split() for line in snmp if line.startswith(f"{protocol}:")]
+    if len(rows) < 2:
+        return {}
+    names, values = rows[0][1:], rows[1][1:]
+    return dict(zip(names, map(int, values)))
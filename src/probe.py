@@ -0,0 +1,52 @@
+# Copyright 2024 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Order controller API addresses by TCP connect latency."""
+
+import asyncio
+import time
+from typing import Dict, Iterable, List, Optional, Sequence
+
+# The current first address is kept while it is at most this many times slower
+# than the fastest one, so that jitter doesn't reorder the list on every probe.
+STICKINESS = 1.5
+
+
+async def connect_latency(address: str, timeout: float = 1.0) -> Optional[float]:
+    """Return how long a TCP connection to `address` ("host:port") takes, or None on failure."""
+    host, _, port = address.rpartition(":")
+    start = time.monotonic()
+    try:
+        _, writer = await asyncio.wait_for(
+            asyncio.open_connection(host.strip("[]"), int(port)), timeout
+        )
+    except (OSError, ValueError, asyncio.TimeoutError):
+        return None
+    latency = time.monotonic() - start
+    writer.close()
+    return latency
+
+
+async def probe(addresses: Iterable[str], timeout: float = 1.0) -> Dict[str, Optional[float]]:
+    """Measure the connect latency of every address in parallel."""
+    addresses = list(dict.fromkeys(addresses))
+    latencies = await asyncio.gather(*(connect_latency(a, timeout) for a in addresses))
+    return dict(zip(addresses, latencies))
+
+
+def rank(latencies: Dict[str, Optional[float]], previous: Sequence[str] = ()) -> List[str]:
+    """Order addresses fastest first, unreachable ones last, as a failover list.
+
+    The first address of `previous` stays first while it is reachable and within
+    STICKINESS of the fastest address.
+    """
+    reachable = sorted(
+        (a for a, latency in latencies.items() if latency is not None), key=latencies.get
+    )
+    unreachable = [a for a, latency in latencies.items() if latency is None]
+    if reachable and previous and previous[0] in reachable:
+        current = previous[0]
+        if latencies[current] <= latencies[reachable[0]] * STICKINESS:
+            reachable.remove(current)
+            reachable.insert(0, current)
+    return reachable + unreachable
@@ -0,0 +1,183 @@
+# Copyright 2024 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Sampled CoreDNS query log, kept in a size-capped ring buffer on the unit.
+
+CoreDNS writes one JSON line per sampled query to the journal of the juju-dns
+service. `collect` moves the lines written since the last call into a
+`RingBuffer`, and `summarize` reports the busiest names and clients and the
+slowest queries found there.
+"""
+
+import collections
+import json
+import os
+import subprocess
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# The journal of every service of the juju-dns snap.
+JOURNAL_UNITS = "snap.juju-dns.*"
+
+# The JSON object CoreDNS's log plugin writes for every sampled query, as a
+# Corefile string: every `{placeholder}` is filled in by the plugin.
+LOG_FORMAT = (
+    '{\\"remote\\":\\"{remote}\\",\\"name\\":\\"{name}\\",\\"type\\":\\"{type}\\",'
+    '\\"proto\\":\\"{proto}\\",\\"rcode\\":\\"{rcode}\\",\\"size\\":{rsize},'
+    '\\"duration\\":\\"{duration}\\"}'
+)
+
+# The JSON object logged for every denied (NXDOMAIN, NODATA) or refused answer,
+# with `log-denials`. Refused answers are in the log plugin's "error" class.
+DENIAL_FORMAT = (
+    '{\\"answer\\":\\"denied\\",\\"remote\\":\\"{remote}\\",\\"name\\":\\"{name}\\",'
+    '\\"type\\":\\"{type}\\",\\"rcode\\":\\"{rcode}\\"}'
+)
+
+
+class RingBuffer:
+    """Newline separated records stored in two segments under `directory`.
+
+    Records are appended to the current segment; once it holds half of
+    `max_bytes` it replaces the previous segment, whose records are dropped.
+    The buffer never uses more than `max_bytes` on disk.
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.current = os.path.join(directory, "query-log.current")
+        self.previous = os.path.join(directory, "query-log.previous")
+        self.segment_bytes = max_bytes // 2
+
+    def append(self, records: Iterable[str]) -> int:
+        """Append `records` and return how many were written."""
+        written = 0
+        size = _size(self.current)
+        out = open(self.current, "a")
+        try:
+            for record in records:
+                line = record.rstrip("\n") + "\n"
+                if len(line) > self.segment_bytes:
+                    continue
+                if size + len(line) > self.segment_bytes:
+                    out.close()
+                    os.replace(self.current, self.previous)
+                    out = open(self.current, "a")
+                    size = 0
+                out.write(line)
+                size += len(line)
+                written += 1
+        finally:
+            out.close()
+        return written
+
+    def read(self) -> List[str]:
+        """Return the stored records, oldest first."""
+        records = []
+        for path in (self.previous, self.current):
+            try:
+                with open(path) as segment:
+                    records.extend(line.rstrip("\n") for line in segment)
+            except FileNotFoundError:
+                pass
+        return records
+
+
+def _size(path: str) -> int:
+    try:
+        return os.path.getsize(path)
+    except FileNotFoundError:
+        return 0
+
+
+def collect(cursor: Optional[str] = None) -> Tuple[List[str], Optional[str]]:
+    """Read the query log lines written to the journal after `cursor`.
+
+    Returns:
+        the lines, and the cursor to pass to the next call.
+    """
+    command = ["journalctl", "--unit", JOURNAL_UNITS, "--output", "cat", "--show-cursor"]
+    if cursor:
+        command += ["--after-cursor", cursor]
+    else:
+        # First collection: don't walk the whole journal.
+        command += ["--since", "-1h"]
+    output = subprocess.run(command, capture_output=True, text=True, check=True).stdout
+
+    lines = []
+    for line in output.splitlines():
+        if line.startswith("-- cursor: "):
+            cursor = line[len("-- cursor: ") :]
+            continue
+        record = _record(line)
+        if record.startswith('{"remote":'):
+            lines.append(record)
+    return lines, cursor
+
+
+def denied_clients(since: str = "-1h", top: int = 10) -> List[Tuple[str, int]]:
+    """Count the denied answers logged since `since` per client, the top `top` first."""
+    command = ["journalctl", "--unit", JOURNAL_UNITS, "--output", "cat", "--since", since]
+    output = subprocess.run(command, capture_output=True, text=True, check=True).stdout
+
+    clients = collections.Counter()
+    for line in output.splitlines():
+        record = _record(line)
+        if not record.startswith('{"answer":"denied",'):
+            continue
+        try:
+            clients[json.loads(record)["remote"]] += 1
+        except (ValueError, KeyError, TypeError):
+            continue
+    return clients.most_common(top)
+
+
+def _record(line: str) -> str:
+    """Return a journal line without the level prefix CoreDNS writes, such as "[INFO] "."""
+    if line.startswith("[INFO] "):
+        return line[len("[INFO] ") :]
+    return line
+
+
+def _seconds(duration: str) -> float:
+    """Convert a CoreDNS duration, such as "0.000213s", to seconds."""
+    try:
+        return float(str(duration).rstrip("s"))
+    except ValueError:
+        return 0.0
+
+
+def summarize(records: Iterable[str], top: int = 10) -> Dict[str, object]:
+    """Report the top `top` names, clients and slowest queries among `records`."""
+    import resolver
+
+    names = collections.Counter()
+    clients = collections.Counter()
+    rcodes = collections.Counter()
+    latencies = []
+    slowest: List[Tuple[float, str]] = []
+    for record in records:
+        try:
+            query = json.loads(record)
+            name = f"{query['name']} {query['type']}"
+            client, rcode = query["remote"], query["rcode"]
+            seconds = _seconds(query["duration"])
+        except (ValueError, KeyError, TypeError):
+            continue
+        names[name] += 1
+        clients[client] += 1
+        rcodes[rcode.lower()] += 1
+        latencies.append(seconds)
+        slowest.append((seconds, f"{name} {rcode}"))
+
+    slowest.sort(reverse=True)
+    return {
+        "queries": len(latencies),
+        "latency-ms": resolver.percentiles(latencies),
+        "rcodes": dict(rcodes),
+        "top-names": "\n".join(f"{count} {name}" for name, count in names.most_common(top)),
+        "top-clients": "\n".join(
+            f"{count} {client}" for client, count in clients.most_common(top)
+        ),
+        "slowest": "\n".join(
+            f"{round(seconds * 1000, 3)}ms {query}" for seconds, query in slowest[:top]
+        ),
+    }
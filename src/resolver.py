@@ -0,0 +1,278 @@
+# Copyright 2024 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Minimal asyncio DNS client used to warm and probe the local CoreDNS listener.
+
+Only the standard library is used: queries are encoded by hand and sent over a
+single UDP socket, replies are matched back to their query by message ID.
+"""
+
+import asyncio
+import collections
+import itertools
+import random
+import socket
+import struct
+import time
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+TYPE_A = 1
+TYPE_PTR = 12
+TYPE_AAAA = 28
+TYPE_OPT = 41
+
+TYPES = {"A": TYPE_A, "PTR": TYPE_PTR, "AAAA": TYPE_AAAA}
+
+RCODES = {
+    0: "NOERROR",
+    1: "FORMERR",
+    2: "SERVFAIL",
+    3: "NXDOMAIN",
+    4: "NOTIMP",
+    5: "REFUSED",
+}
+
+_HEADER = struct.Struct("!HHHHHH")
+_FLAG_RD = 0x0100
+_FLAG_TC = 0x0200
+
+
+@dataclass
+class Answer:
+    """The outcome of a single query."""
+
+    name: str
+    rcode: str
+    latency: float
+    size: int = 0
+    truncated: bool = False
+    addresses: List[str] = field(default_factory=list)
+
+
+def encode_query(query_id: int, name: str, qtype: int = TYPE_A, bufsize: int = 0) -> bytes:
+    """Encode a recursive query for `name`.
+
+    When `bufsize` is set, an EDNS0 OPT record advertises it as the largest UDP
+    response the client accepts; otherwise the classic 512 bytes limit applies.
+    """
+    qname = b"".join(
+        bytes([len(label)]) + label.encode("idna")
+        for label in name.rstrip(".").split(".")
+        if label
+    )
+    question = qname + b"\0" + struct.pack("!HH", qtype, 1)
+    if not bufsize:
+        return _HEADER.pack(query_id, _FLAG_RD, 1, 0, 0, 0) + question
+    opt = b"\0" + struct.pack("!HHIH", TYPE_OPT, bufsize, 0, 0)
+    return _HEADER.pack(query_id, _FLAG_RD, 1, 0, 0, 1) + question + opt
+
+
+def _skip_name(message: bytes, offset: int) -> int:
+    """Return the offset right after the (possibly compressed) name at `offset`."""
+    while True:
+        length = message[offset]
+        if length & 0xC0 == 0xC0:
+            return offset + 2
+        offset += 1 + length
+        if length == 0:
+            return offset
+
+
+def decode_response(message: bytes) -> Tuple[int, str, bool, List[str]]:
+    """Decode the ID, rcode, TC flag and A/AAAA addresses of a response."""
+    query_id, flags, qdcount, ancount, _, _ = _HEADER.unpack_from(message)
+    offset = _HEADER.size
+    for _ in range(qdcount):
+        offset = _skip_name(message, offset) + 4
+
+    addresses = []
+    for _ in range(ancount):
+        offset = _skip_name(message, offset)
+        rtype, _, _, rdlength = struct.unpack_from("!HHIH", message, offset)
+        offset += 10
+        rdata = message[offset : offset + rdlength]
+        if rtype == TYPE_A and rdlength == 4:
+            addresses.append(socket.inet_ntop(socket.AF_INET, rdata))
+        elif rtype == TYPE_AAAA and rdlength == 16:
+            addresses.append(socket.inet_ntop(socket.AF_INET6, rdata))
+        offset += rdlength
+
+    rcode = RCODES.get(flags & 0xF, str(flags & 0xF))
+    return query_id, rcode, bool(flags & _FLAG_TC), addresses
+
+
+class _Protocol(asyncio.DatagramProtocol):
+    def __init__(self, pending: Dict[int, asyncio.Future]):
+        self.pending = pending
+
+    def datagram_received(self, data: bytes, addr) -> None:
+        try:
+            query_id = _HEADER.unpack_from(data)[0]
+        except struct.error:
+            return
+        future = self.pending.pop(query_id, None)
+        if future is not None and not future.done():
+            future.set_result(data)
+
+
+class Resolver:
+    """Send queries to a single DNS server over one UDP socket.
+
+    Use as an async context manager:
+
+        async with Resolver("127.0.0.1", 1053) as resolver:
+            answer = await resolver.query("unit-0.model.controller.juju.local")
+    """
+
+    def __init__(self, host: str, port: int, timeout: float = 2.0, bufsize: int = 0):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.bufsize = bufsize
+        self._pending: Dict[int, asyncio.Future] = {}
+        self._transport: Optional[asyncio.DatagramTransport] = None
+
+    async def __aenter__(self) -> "Resolver":
+        """Open the UDP socket."""
+        loop = asyncio.get_running_loop()
+        self._transport, _ = await loop.create_datagram_endpoint(
+            lambda: _Protocol(self._pending), remote_addr=(self.host, self.port)
+        )
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        """Close the UDP socket."""
+        if self._transport is not None:
+            self._transport.close()
+
+    def _new_id(self) -> int:
+        while True:
+            query_id = random.getrandbits(16)
+            if query_id not in self._pending:
+                return query_id
+
+    async def query(self, name: str, qtype: int = TYPE_A) -> Answer:
+        """Send one query and wait for its reply, or time out."""
+        query_id = self._new_id()
+        future = asyncio.get_running_loop().create_future()
+        self._pending[query_id] = future
+
+        start = time.monotonic()
+        self._transport.sendto(encode_query(query_id, name, qtype, self.bufsize))
+        try:
+            message = await asyncio.wait_for(future, self.timeout)
+        except asyncio.TimeoutError:
+            self._pending.pop(query_id, None)
+            return Answer(name, "TIMEOUT", time.monotonic() - start)
+        latency = time.monotonic() - start
+
+        _, rcode, truncated, addresses = decode_response(message)
+        return Answer(name, rcode, latency, len(message), truncated, addresses)
+
+
+async def resolve_all(
+    host: str,
+    port: int,
+    names: Iterable[str],
+    concurrency: int = 16,
+    timeout: float = 2.0,
+    qtype: int = TYPE_A,
+) -> List[Answer]:
+    """Resolve every name in `names`, with at most `concurrency` queries in flight."""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async with Resolver(host, port, timeout) as resolver:
+
+        async def bounded(name: str) -> Answer:
+            async with semaphore:
+                return await resolver.query(name, qtype)
+
+        return await asyncio.gather(*(bounded(name) for name in names))
+
+
+async def benchmark(
+    host: str,
+    port: int,
+    queries: Sequence[Tuple[str, int]],
+    qps: int = 0,
+    duration: float = 10.0,
+    concurrency: int = 64,
+    timeout: float = 2.0,
+    bufsize: int = 0,
+) -> Tuple[List[Answer], float]:
+    """Send `queries` round robin for `duration` seconds and return the answers and elapsed time.
+
+    Queries are paced to `qps` per second when set, otherwise sent as fast as the
+    `concurrency` limit on queries in flight allows. `bufsize` is the EDNS0 UDP
+    buffer size advertised in every query, 0 to send plain DNS queries.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    tasks = []
+
+    async with Resolver(host, port, timeout, bufsize) as resolver:
+
+        async def bounded(name: str, qtype: int) -> Answer:
+            try:
+                return await resolver.query(name, qtype)
+            finally:
+                semaphore.release()
+
+        start = time.monotonic()
+        for sent, (name, qtype) in enumerate(itertools.cycle(queries)):
+            now = time.monotonic()
+            if now - start >= duration:
+                break
+            if qps:
+                delay = start + sent / qps - now
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            await semaphore.acquire()
+            tasks.append(asyncio.ensure_future(bounded(name, qtype)))
+
+        answers = await asyncio.gather(*tasks)
+        return answers, time.monotonic() - start
+
+
+def summarize(answers: List[Answer], elapsed: float) -> dict:
+    """Summarize benchmark answers into throughput, latency, size and rcode figures."""
+    replied = [answer for answer in answers if answer.rcode != "TIMEOUT"]
+    truncated = sum(answer.truncated for answer in replied)
+    rcodes = collections.Counter(answer.rcode.lower() for answer in answers)
+    return {
+        "queries": len(answers),
+        "responses": len(replied),
+        "timeouts": len(answers) - len(replied),
+        "truncated": truncated,
+        "truncation-rate": round(truncated / len(replied), 4) if replied else 0,
+        "bytes-per-response": (
+            round(sum(answer.size for answer in replied) / len(replied), 1) if replied else 0
+        ),
+        "qps": round(len(replied) / elapsed, 1) if elapsed else 0,
+        "latency-ms": percentiles([answer.latency for answer in replied]),
+        "rcodes": dict(rcodes),
+    }
+
+
+async def wait_ready(host: str, port: int, name: str, deadline: float = 10.0) -> bool:
+    """Query `name` until the server replies at all, for up to `deadline` seconds."""
+    end = time.monotonic() + deadline
+    async with Resolver(host, port, timeout=0.5) as resolver:
+        while time.monotonic() < end:
+            if (await resolver.query(name)).rcode != "TIMEOUT":
+                return True
+            await asyncio.sleep(0.2)
+    return False
+
+
+def percentiles(latencies: List[float], points: Iterable[int] = (50, 95, 99)) -> Dict[str, float]:
+    """Return the nearest-rank percentiles and the maximum of `latencies`, in milliseconds."""
+    if not latencies:
+        return {}
+    ordered = sorted(latencies)
+    result = {}
+    for point in points:
+        rank = max(0, -(-point * len(ordered) // 100) - 1)
+        result[f"p{point}"] = round(ordered[rank] * 1000, 3)
+    result["max"] = round(ordered[-1] * 1000, 3)
+    return result
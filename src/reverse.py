@@ -0,0 +1,56 @@
+# Copyright 2024 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Reverse (PTR) map of juju names, served by the CoreDNS hosts plugin.
+
+The charm resolves known names forward and writes their addresses to a hosts
+file. The hosts plugin indexes it in memory, answers PTR queries for
+in-addr.arpa and ip6.arpa from it, and reloads it by itself when it changes.
+"""
+
+import ipaddress
+from typing import Dict, Iterable, List, Mapping, Sequence, Set
+
+from resolver import TYPE_A, TYPE_AAAA
+
+# Answers that say nothing about the name: its previous addresses are kept.
+_UNKNOWN = frozenset({"TIMEOUT", "SERVFAIL", "REFUSED"})
+
+# The IP version of the addresses answered to each query type.
+_VERSIONS = {TYPE_A: 4, TYPE_AAAA: 6}
+
+
+def update(
+    known: Mapping[str, Sequence[str]], answers: Mapping[int, Iterable]
+) -> Dict[str, List[str]]:
+    """Return the map of name to addresses, updated with the answers to each query type.
+
+    Query types are merged separately. A name gets the new addresses of the types
+    that resolved, and keeps its previous addresses of the types that didn't get
+    an answer, so that a slow controller doesn't empty the map. A name left
+    without addresses is dropped.
+    """
+    names: Dict[str, Set[str]] = {}
+    for qtype, type_answers in answers.items():
+        for answer in type_answers:
+            addresses = names.setdefault(answer.name, set())
+            if answer.rcode not in _UNKNOWN:
+                addresses.update(answer.addresses)
+                continue
+            addresses.update(
+                address
+                for address in known.get(answer.name, ())
+                if ipaddress.ip_address(address).version == _VERSIONS[qtype]
+            )
+    return {name: sorted(addresses) for name, addresses in sorted(names.items()) if addresses}
+
+
+def hosts_file(names: Mapping[str, Sequence[str]]) -> str:
+    """Render the map as a hosts file: one line per address, with every name it has."""
+    by_address: Dict[str, List[str]] = {}
+    for name in sorted(names):
+        for address in names[name]:
+            by_address.setdefault(address, []).append(name)
+    return "".join(
+        f"{address} {' '.join(names)}\n" for address, names in sorted(by_address.items())
+    )
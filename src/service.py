@@ -0,0 +1,46 @@
+# Copyright 2024 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""systemd units of the juju-dns snap services."""
+
+import subprocess
+from typing import Dict, Iterable
+
+# Charm options mapped to the systemd resource control setting they manage.
+RESOURCE_CONTROLS = {
+    "cpu-quota": "CPUQuota",
+    "cpu-affinity": "AllowedCPUs",
+    "memory-max": "MemoryMax",
+    "io-weight": "IOWeight",
+    "nice": "Nice",
+}
+
+# The `systemctl show` properties reporting the effective resource controls.
+EFFECTIVE_PROPERTIES = {
+    "CPUQuotaPerSecUSec": "cpu-quota-per-sec",
+    "AllowedCPUs": "cpu-affinity",
+    "MemoryMax": "memory-max",
+    "IOWeight": "io-weight",
+    "Nice": "nice",
+}
+
+
+def unit_name(snap_name: str, service: str) -> str:
+    """Return the systemd unit running a snap service."""
+    return f"snap.{snap_name}.{service}.service"
+
+
+def daemon_reload() -> None:
+    """Make systemd reload the unit files and their drop-ins."""
+    subprocess.run(["systemctl", "daemon-reload"], capture_output=True, check=True)
+
+
+def show(unit: str, properties: Iterable[str]) -> Dict[str, str]:
+    """Return the current value of `properties` of `unit`."""
+    output = subprocess.run(
+        ["systemctl", "show", unit, "--property", ",".join(properties)],
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    return dict(line.split("=", 1) for line in output.splitlines() if "=" in line)
@@ -0,0 +1,27 @@
+# Copyright 2024 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Spread controllers over the juju-dns units with rendezvous hashing.
+
+Every unit computes the same owner for a controller from the list of units
+alone, without coordination. Adding or removing a unit only moves the
+controllers that it gains or owned: the others keep their owner.
+"""
+
+import hashlib
+from typing import Dict, Iterable
+
+
+def _weight(node: str, key: str) -> int:
+    return int.from_bytes(hashlib.sha256(f"{node}\0{key}".encode()).digest()[:8], "big")
+
+
+def owner(key: str, nodes: Iterable[str]) -> str:
+    """Return the node owning `key`: the one with the highest hash of (node, key)."""
+    return max(nodes, key=lambda node: (_weight(node, key), node))
+
+
+def assign(keys: Iterable[str], nodes: Iterable[str]) -> Dict[str, str]:
+    """Return the owner of every key."""
+    nodes = sorted(set(nodes))
+    return {key: owner(key, nodes) for key in keys}
@@ -0,0 +1,583 @@
+# Copyright 2024 nicolas
+# See LICENSE file for licensing details.
+
+import json
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import ops
+import ops.testing
+import yaml
+from charms.operator_libs_linux.v2 import snap
+
+import config
+import sharding
+from charm import JujuDnsCharm
+from resolver import Answer
+
+DEFAULTS = {
+    name: option["default"]
+    for name, option in yaml.safe_load(Path("charmcraft.yaml").read_text())["config"][
+        "options"
+    ].items()
+}
+
+
+class TestConfig(unittest.TestCase):
+    def setUp(self):
+        self.harness = ops.testing.Harness(JujuDnsCharm)
+        self.addCleanup(self.harness.cleanup)
+
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.plugin_config = Path(tmp.name, "juju-dns-config.yaml")
+        self.corefile = Path(tmp.name, "Corefile")
+        self.sysctl = Path(tmp.name, "60-juju-dns.conf")
+        self.resolved = Path(tmp.name, "resolved.conf.d", "juju.conf")
+        for target, path in (
+            ("charm.JUJU_DNS_PLUGIN_CONFIG_PATH", self.plugin_config),
+            ("charm.COREFILE_PATH", self.corefile),
+            ("charm.SYSCTL_PATH", self.sysctl),
+            ("charm.RESOLVED_DROPIN_PATH", self.resolved),
+        ):
+            patcher = mock.patch(target, str(path))
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(JujuDnsCharm, "_restart_snap")
+        self.restart_snap = patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch("charm.SERVICE_DROPIN_PATH", f"{tmp.name}/{{unit}}.d/juju-dns.conf")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.service_dropin = Path(tmp.name, "snap.juju-dns.coredns.service.d/juju-dns.conf")
+        patcher = mock.patch("subprocess.run")
+        self.run = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.latencies = {}
+        patcher = mock.patch(
+            "probe.connect_latency",
+            side_effect=lambda address, timeout: self.latencies.get(address),
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.juju_dns = mock.MagicMock(services={"coredns": {}})
+        patcher = mock.patch.object(snap, "SnapCache", return_value={"juju-dns": self.juju_dns})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def add_controller(self, name: str = "prod", address: str = "10.0.0.1:17070"):
+        relation_id = self.harness.add_relation("controller", "controller")
+        self.harness.add_relation_unit(relation_id, "controller/0")
+        self.harness.update_relation_data(
+            relation_id,
+            "controller/0",
+            {"controller_name": name, "address": address, "username": "admin", "password": "pw"},
+        )
+        return relation_id
+
+    def rendered_config(self) -> dict:
+        return yaml.safe_load(self.plugin_config.read_text())
+
+    def test_limits_rendered_per_controller(self):
+        self.harness.begin()
+        self.add_controller()
+        self.harness.update_config(
+            {"max-concurrent-requests": 8, "controller-limits": "prod: {request-timeout: 3}"}
+        )
+
+        config = self.rendered_config()
+        self.assertEqual(config["max-concurrent-requests"], 8)
+        self.assertEqual(config["controllers"]["prod"]["address"], "10.0.0.1:17070")
+        self.assertEqual(config["controllers"]["prod"]["max-concurrent-requests"], 8)
+        self.assertEqual(config["controllers"]["prod"]["request-timeout"], 3)
+        self.assertEqual(config["controllers"]["prod"]["cache-ttl"], 30)
+        self.assertEqual(self.harness.model.unit.status, ops.ActiveStatus())
+
+    def test_controller_addresses_ordered_by_latency(self):
+        self.harness.begin()
+        self.harness.update_config({})
+        self.latencies = {"10.0.0.2:17070": 0.002, "10.0.0.3:17070": 0.001}
+        relation_id = self.add_controller(address="10.0.0.1:17070")
+        for unit, address in (
+            ("controller/1", "10.0.0.2:17070"),
+            ("controller/2", "10.0.0.3:17070"),
+        ):
+            self.harness.add_relation_unit(relation_id, unit)
+            self.harness.update_relation_data(
+                relation_id,
+                unit,
+                {
+                    "controller_name": "prod",
+                    "address": address,
+                    "username": "admin",
+                    "password": "pw",
+                },
+            )
+
+        prod = self.rendered_config()["controllers"]["prod"]
+        self.assertEqual(prod["addresses"], ["10.0.0.3:17070", "10.0.0.2:17070", "10.0.0.1:17070"])
+        self.assertEqual(prod["address"], "10.0.0.3:17070")
+
+        # Refreshed on update-status, the closest address going away.
+        self.restart_snap.reset_mock()
+        self.latencies = {"10.0.0.1:17070": 0.003, "10.0.0.2:17070": 0.002}
+        self.harness.charm.on.update_status.emit()
+
+        prod = self.rendered_config()["controllers"]["prod"]
+        self.assertEqual(prod["addresses"], ["10.0.0.2:17070", "10.0.0.1:17070", "10.0.0.3:17070"])
+        self.restart_snap.assert_called_once()
+
+        # A faster address is written, but the reachable one in use is kept.
+        self.restart_snap.reset_mock()
+        self.latencies = {"10.0.0.1:17070": 0.001, "10.0.0.2:17070": 0.004}
+        self.harness.charm.on.update_status.emit()
+
+        prod = self.rendered_config()["controllers"]["prod"]
+        self.assertEqual(prod["addresses"], ["10.0.0.1:17070", "10.0.0.2:17070", "10.0.0.3:17070"])
+        self.restart_snap.assert_not_called()
+
+        # Unchanged order, nothing to restart.
+        self.restart_snap.reset_mock()
+        self.harness.charm.on.update_status.emit()
+        self.restart_snap.assert_not_called()
+
+    def test_record_ttls_rendered(self):
+        self.harness.begin()
+        self.harness.update_config(
+            {"ttl": "2m", "unit-ttl": "30s", "negative-ttl": 10, "ttl-jitter": 20}
+        )
+
+        config = self.rendered_config()
+        self.assertEqual(config["ttl"], 120)
+        self.assertEqual(
+            config["ttls"], {"machine": 120, "unit": 30, "application": 120, "negative": 10}
+        )
+        self.assertEqual(config["ttl-jitter"], 20)
+
+    def test_jitter_expiring_a_ttl_at_once_blocks(self):
+        self.harness.begin()
+        self.harness.update_config({"machine-ttl": "1", "ttl-jitter": 50})
+
+        self.assertEqual(
+            self.harness.model.unit.status,
+            ops.BlockedStatus("invalid config: ttl-jitter 50% would expire machine-ttl at once"),
+        )
+
+    def test_sharded_controllers(self):
+        names = [f"c{i}" for i in range(6)]
+        owners = sharding.assign(names, ["juju-dns/0", "juju-dns/1"])
+        owned = {name for name, owner in owners.items() if owner == "juju-dns/0"}
+        self.assertTrue(owned and owned != set(names))
+
+        self.harness.begin()
+        self.harness.update_config({"shard-controllers": True})
+        for i, name in enumerate(names):
+            self.add_controller(name, f"10.0.1.{i}:17070")
+        peers = self.harness.add_relation("juju-dns-peers", "juju-dns")
+        self.harness.add_relation_unit(peers, "juju-dns/1")
+        self.harness.update_relation_data(
+            peers, "juju-dns/1", {"address": "10.0.0.11", "port": "1053"}
+        )
+
+        self.assertEqual(set(self.rendered_config()["controllers"]), owned)
+        corefile = self.corefile.read_text()
+        for name in names:
+            zone = f"{name}.juju.local:1053 {{"
+            if name in owned:
+                self.assertNotIn(zone, corefile)
+            else:
+                self.assertIn(
+                    f"{zone}\n    prometheus 127.0.0.1:9153\n    cache\n"
+                    "    forward . 10.0.0.11:1053\n}",
+                    corefile,
+                )
+
+        # Back to owning every controller once the other unit is gone.
+        self.harness.remove_relation_unit(peers, "juju-dns/1")
+        self.assertEqual(set(self.rendered_config()["controllers"]), set(names))
+        self.assertNotIn("forward", self.corefile.read_text())
+
+    def test_watch_mode_rendered(self):
+        self.harness.begin()
+        self.add_controller()
+        self.harness.update_config({"resolution-mode": "watch"})
+
+        self.assertEqual(self.rendered_config()["resolution-mode"], "watch")
+        self.assertEqual(self.harness.model.unit.status, ops.ActiveStatus())
+
+    def test_controller_watched_twice_blocks(self):
+        self.harness.begin()
+        self.harness.update_config({"resolution-mode": "watch"})
+        self.add_controller("prod")
+        self.add_controller("prod-alias")
+
+        self.assertEqual(
+            self.harness.model.unit.status,
+            ops.BlockedStatus(
+                "controllers prod and prod-alias share the API address 10.0.0.1:17070: "
+                "only one watcher per controller"
+            ),
+        )
+        self.assertEqual(set(self.rendered_config()["controllers"]), {"prod"})
+
+        # Looked up on demand, the same controller can be related twice.
+        self.harness.update_config({"resolution-mode": "on-demand"})
+        self.assertEqual(self.harness.model.unit.status, ops.ActiveStatus())
+        self.assertEqual(set(self.rendered_config()["controllers"]), {"prod", "prod-alias"})
+
+    def test_invalid_config_stays_blocked(self):
+        self.harness.begin()
+        self.harness.update_config({})
+        self.harness.update_config({"ttl": "bogus"})
+        blocked = self.harness.model.unit.status
+        self.assertIsInstance(blocked, ops.BlockedStatus)
+
+        self.add_controller()
+        self.assertEqual(self.harness.model.unit.status, blocked)
+        self.harness.charm.on.start.emit()
+        self.assertEqual(self.harness.model.unit.status, blocked)
+
+    def test_node_local_mode(self):
+        self.harness.begin()
+        self.harness.update_config({})
+        self.run.reset_mock()
+
+        self.harness.update_config(
+            {"mode": "node-local", "upstream-servers": "10.0.0.5 10.0.0.6:5353"}
+        )
+
+        corefile = self.corefile.read_text()
+        self.assertIn("juju.local:1053 {", corefile)
+        self.assertIn("bind 127.0.0.1", corefile)
+        self.assertIn("forward . 10.0.0.5:1053 10.0.0.6:5353", corefile)
+        self.assertNotIn("    juju\n", corefile)
+        self.assertEqual(
+            self.resolved.read_text().splitlines()[1:],
+            ["[Resolve]", "DNS=127.0.0.1:1053", "Domains=~juju.local"],
+        )
+        self.run.assert_called_once_with(
+            ["systemctl", "reload-or-restart", "systemd-resolved"],
+            capture_output=True,
+            check=True,
+        )
+        self.assertEqual(self.harness.model.unit.opened_ports(), set())
+
+        # Back to a server, resolved stops sending the zone to the unit.
+        self.harness.update_config({"mode": "server"})
+        self.assertFalse(self.resolved.exists())
+        self.assertIn(".:1053 {", self.corefile.read_text())
+        self.assertEqual(self.harness.model.unit.opened_ports(), {ops.Port("udp", 1053)})
+
+    def test_node_local_requires_upstream_servers(self):
+        self.harness.begin()
+        self.harness.update_config({"mode": "node-local"})
+
+        self.assertEqual(
+            self.harness.model.unit.status,
+            ops.BlockedStatus(
+                "mode node-local requires upstream-servers or a dns-upstream relation"
+            ),
+        )
+
+    def test_node_local_follows_dns_upstream(self):
+        self.harness.begin()
+        self.harness.update_config({"mode": "node-local"})
+        self.restart_snap.reset_mock()
+
+        relation_id = self.harness.add_relation("dns-upstream", "juju-dns-servers")
+        self.harness.update_relation_data(
+            relation_id,
+            "juju-dns-servers",
+            {
+                "servers": json.dumps(
+                    [
+                        {"unit": "juju-dns-servers/0", "address": "10.0.0.5", "port": 1053},
+                        {"unit": "juju-dns-servers/1", "address": "10.0.0.6", "port": 5353},
+                    ]
+                )
+            },
+        )
+
+        self.assertIn("forward . 10.0.0.5:1053 10.0.0.6:5353", self.corefile.read_text())
+        self.restart_snap.assert_called_once()
+        self.assertEqual(self.harness.model.unit.status, ops.ActiveStatus())
+
+        # upstream-servers overrides the published servers.
+        self.harness.update_config({"upstream-servers": "10.0.0.7"})
+        self.assertIn("forward . 10.0.0.7:1053\n", self.corefile.read_text())
+
+        self.harness.update_config({"upstream-servers": ""})
+        self.harness.remove_relation(relation_id)
+        self.assertNotIn("forward", self.corefile.read_text())
+        self.assertIsInstance(self.harness.model.unit.status, ops.BlockedStatus)
+
+    def test_invalid_limit_blocks(self):
+        self.harness.begin()
+        self.harness.update_config({"request-timeout": 0})
+
+        self.assertIsInstance(self.harness.model.unit.status, ops.BlockedStatus)
+        self.assertIn("request-timeout", self.harness.model.unit.status.message)
+        self.assertFalse(self.plugin_config.exists())
+
+    def test_pool_larger_than_concurrency_blocks(self):
+        self.harness.begin()
+        self.harness.update_config({"controller-limits": "prod: {connection-pool-size: 64}"})
+
+        self.assertIsInstance(self.harness.model.unit.status, ops.BlockedStatus)
+        self.assertIn("controller-limits prod", self.harness.model.unit.status.message)
+
+    def test_unknown_controller_limit_blocks(self):
+        self.harness.begin()
+        self.harness.update_config({"controller-limits": "prod: {retries: 3}"})
+
+        self.assertIsInstance(self.harness.model.unit.status, ops.BlockedStatus)
+        self.assertIn("retries", self.harness.model.unit.status.message)
+
+    def test_negative_cache_rendered(self):
+        self.harness.begin()
+        self.harness.update_config({"negative-ttl": 30})
+
+        corefile = self.corefile.read_text()
+        self.assertIn("denial 9984 30", corefile)
+
+    def test_denials_logged(self):
+        self.harness.begin()
+        self.harness.update_config({"log-denials": True})
+
+        corefile = self.corefile.read_text()
+        self.assertIn('log . "{\\"answer\\":\\"denied\\"', corefile)
+        self.assertIn("class denial error", corefile)
+
+    def test_negative_cache_disabled(self):
+        self.harness.begin()
+        self.harness.update_config({"negative-ttl": 0})
+
+        corefile = self.corefile.read_text()
+        self.assertIn("disable denial", corefile)
+
+    def test_edns_options_rendered(self):
+        self.harness.begin()
+        self.harness.update_config({})
+        corefile = self.corefile.read_text()
+        self.assertIn("bufsize 1232", corefile)
+        self.assertNotIn("minimal", corefile)
+
+        self.harness.update_config({"edns-bufsize": 4096, "minimal-responses": True})
+        corefile = self.corefile.read_text()
+        self.assertIn("bufsize 4096", corefile)
+        self.assertIn("minimal", corefile)
+
+    def test_sampled_query_log_rendered(self):
+        self.harness.begin()
+        self.harness.update_config({"query-log-sample": 100})
+
+        corefile = self.corefile.read_text()
+        self.assertEqual(corefile.count(".:1053 {"), 2)
+        self.assertIn("expr id() % 100 == 0", corefile)
+        self.assertIn('log . "{\\"remote\\":\\"{remote}\\"', corefile)
+
+    def test_loadbalance_rendered(self):
+        self.harness.begin()
+        self.harness.update_config({})
+        self.assertIn("loadbalance round_robin", self.corefile.read_text())
+
+        weights_file = Path(self.corefile.parent, "loadbalance-weights")
+        with mock.patch("charm.LOADBALANCE_WEIGHTS_PATH", str(weights_file)):
+            self.harness.update_config(
+                {
+                    "loadbalance": "weighted",
+                    "loadbalance-weights": "app.default.prod.juju.local.: {10.0.0.1: 3, 10.0.0.2: 1}",
+                }
+            )
+
+        self.assertIn(f"loadbalance weighted {weights_file}", self.corefile.read_text())
+        self.assertEqual(
+            weights_file.read_text(), "app.default.prod.juju.local\n10.0.0.1 3\n10.0.0.2 1\n"
+        )
+
+    def test_weighted_loadbalance_requires_weights(self):
+        self.harness.begin()
+        self.harness.update_config({"loadbalance": "weighted"})
+
+        self.assertEqual(
+            self.harness.model.unit.status,
+            ops.BlockedStatus("invalid config: loadbalance weighted requires loadbalance-weights"),
+        )
+
+    def test_invalid_loadbalance_weight_blocks(self):
+        self.harness.begin()
+        self.harness.update_config({"loadbalance-weights": "app.juju.local: {10.0.0.1: 0}"})
+
+        self.assertIsInstance(self.harness.model.unit.status, ops.BlockedStatus)
+        self.assertIn("loadbalance-weights app.juju.local", self.harness.model.unit.status.message)
+
+    def test_max_answers_rendered_per_controller(self):
+        self.harness.begin()
+        self.add_controller()
+        self.harness.update_config(
+            {"max-answers": 8, "controller-limits": "prod: {max-answers: 0}"}
+        )
+
+        config = self.rendered_config()
+        self.assertEqual(config["max-answers"], 8)
+        self.assertEqual(config["controllers"]["prod"]["max-answers"], 0)
+
+    def test_sysctl_applied(self):
+        self.harness.begin()
+        self.harness.update_config({"rmem-max": 8388608, "udp-receive-buffer": 4194304})
+
+        settings = self.sysctl.read_text()
+        self.assertIn("net.core.rmem_max = 8388608", settings)
+        self.assertIn("net.core.rmem_default = 4194304", settings)
+        self.assertNotIn("netdev_max_backlog", settings)
+        self.run.assert_any_call(
+            ["sysctl", "-p", str(self.sysctl)], capture_output=True, check=True
+        )
+        self.restart_snap.assert_called_once()
+
+        # Unrelated changes don't reload the settings.
+        self.run.reset_mock()
+        self.harness.update_config({"negative-ttl": 30})
+        self.run.assert_not_called()
+
+    def test_sysctl_restored(self):
+        self.harness.begin()
+        kernel = {"net.core.rmem_default": "212992", "net.core.rmem_max": "212992"}
+        with mock.patch("charm._sysctl_value", side_effect=kernel.get):
+            self.harness.update_config({"rmem-max": 8388608, "udp-receive-buffer": 4194304})
+            kernel["net.core.rmem_default"] = "4194304"
+            self.run.reset_mock()
+            self.harness.update_config({"udp-receive-buffer": 0})
+
+        self.assertNotIn("rmem_default", self.sysctl.read_text())
+        self.run.assert_any_call(
+            ["sysctl", "-w", "net.core.rmem_default=212992"], capture_output=True, check=True
+        )
+        self.assertEqual(
+            dict(self.harness.charm._stored.sysctl_defaults), {"net.core.rmem_max": "212992"}
+        )
+
+    def test_resource_controls_restart_only_the_service(self):
+        self.harness.begin()
+        self.harness.update_config({})
+        self.assertEqual(self.service_dropin.read_text().splitlines()[1:], ["[Service]"])
+        self.restart_snap.reset_mock()
+        self.run.reset_mock()
+
+        self.harness.update_config({"cpu-quota": "50%", "cpu-affinity": "2-3", "nice": -5})
+
+        dropin = self.service_dropin.read_text()
+        self.assertIn("CPUQuota=50%", dropin)
+        self.assertIn("AllowedCPUs=2-3", dropin)
+        self.assertIn("Nice=-5", dropin)
+        self.assertNotIn("MemoryMax", dropin)
+        self.run.assert_called_once_with(
+            ["systemctl", "daemon-reload"], capture_output=True, check=True
+        )
+        self.restart_snap.assert_called_once_with(["coredns"])
+
+    def test_invalid_resource_control_blocks(self):
+        self.harness.begin()
+        self.harness.update_config({"cpu-affinity": "all"})
+
+        self.assertEqual(
+            self.harness.model.unit.status,
+            ops.BlockedStatus(
+                "invalid config: cpu-affinity must be a list of CPUs such as \"0-1,3\", got 'all'"
+            ),
+        )
+
+    def test_edns_bufsize_out_of_range_blocks(self):
+        self.harness.begin()
+        self.harness.update_config({"edns-bufsize": 256})
+
+        self.assertIsInstance(self.harness.model.unit.status, ops.BlockedStatus)
+        self.assertIn("edns-bufsize", self.harness.model.unit.status.message)
+
+    def test_reverse_zone(self):
+        hosts = self.corefile.with_name("reverse-hosts")
+        addresses = {1: ["10.0.0.6"], 28: []}
+
+        async def resolve_all(host, port, names, qtype):
+            return [Answer(name, "NOERROR", 0.001, addresses=addresses[qtype]) for name in names]
+
+        with mock.patch("charm.REVERSE_HOSTS_PATH", str(hosts)):
+            with mock.patch("resolver.resolve_all", side_effect=resolve_all):
+                self.harness.begin()
+                self.add_controller()
+                self.harness.update_config({"reverse-names": "0.default.{controller}.juju.local"})
+
+                self.assertIn("in-addr.arpa:1053 ip6.arpa:1053 {", self.corefile.read_text())
+                self.assertIn(f"hosts {hosts} {{", self.corefile.read_text())
+                self.assertEqual(hosts.read_text(), "10.0.0.6 0.default.prod.juju.local\n")
+
+                # A changed address only rewrites the map, which CoreDNS reloads by itself.
+                self.restart_snap.reset_mock()
+                addresses[1] = ["10.0.0.7"]
+                self.harness.charm.on.update_status.emit()
+                self.assertEqual(hosts.read_text(), "10.0.0.7 0.default.prod.juju.local\n")
+                self.restart_snap.assert_not_called()
+
+    def test_single_restart_and_unchanged_files_skipped(self):
+        self.harness.begin()
+        self.harness.update_config({"negative-ttl": 30, "ttl": "120"})
+        self.assertEqual(self.restart_snap.call_count, 1)
+
+        # The same content is not written again, so nothing restarts.
+        self.restart_snap.reset_mock()
+        self.harness.update_config({"ttl": "2m"})
+        self.restart_snap.assert_not_called()
+
+    def test_port_change_opens_port_and_rebuilds_corefile_only(self):
+        self.harness.begin()
+        self.harness.update_config({})
+        self.plugin_config.unlink()
+        self.corefile.unlink()
+
+        self.harness.update_config({"port": 5353})
+
+        self.assertEqual(self.harness.model.unit.opened_ports(), {ops.Port("udp", 5353)})
+        self.assertEqual(self.harness.charm._stored.port, 5353)
+        self.assertIn(".:5353", self.corefile.read_text())
+        self.assertFalse(self.plugin_config.exists())
+
+    def test_invalid_port_blocks(self):
+        self.harness.begin()
+        self.harness.update_config({"port": 70000})
+
+        self.assertEqual(
+            self.harness.model.unit.status,
+            ops.BlockedStatus(
+                "invalid config: port must be a port number between 1 and 65535, got 70000"
+            ),
+        )
+
+
+class TestConfigModel(unittest.TestCase):
+    def test_defaults_are_valid(self):
+        charm_config = config.CharmConfig.load(DEFAULTS)
+        self.assertEqual(set(charm_config), {option.name for option in config.OPTIONS})
+        self.assertEqual(set(charm_config), set(DEFAULTS))
+
+    def test_duration(self):
+        self.assertEqual(config.duration("60"), 60)
+        self.assertEqual(config.duration("30s"), 30)
+        self.assertEqual(config.duration("5m"), 300)
+        self.assertEqual(config.duration(" 1h "), 3600)
+        for invalid in ("", "1d", "-5", "five"):
+            with self.assertRaises(config.ConfigError):
+                config.duration(invalid)
+
+    def test_exact_change_set(self):
+        previous = config.CharmConfig.load(DEFAULTS)
+        current = config.CharmConfig.load({**DEFAULTS, "ttl": "5m", "warm-names": "a b"})
+
+        changed = current.changes(dict(previous))
+        self.assertEqual(changed, {"ttl", "warm-names"})
+        self.assertEqual(config.artifacts(changed), {config.PLUGIN_CONFIG})
+        self.assertEqual(
+            config.artifacts({"port"}), {config.PORTS, config.COREFILE, config.RESOLVED}
+        )
+        self.assertEqual(current.changes(dict(current)), set())
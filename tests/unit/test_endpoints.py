@@ -0,0 +1,74 @@
+# Copyright 2024 nicolas
+# See LICENSE file for licensing details.
+
+import json
+import unittest
+
+import ops
+import ops.testing
+
+from charm import JujuDnsCharm
+
+
+class TestEndpoints(unittest.TestCase):
+    def setUp(self):
+        self.harness = ops.testing.Harness(JujuDnsCharm)
+        self.addCleanup(self.harness.cleanup)
+        self.harness.add_network("10.0.0.10", endpoint="dns-endpoints")
+        self.peers = self.harness.add_relation("juju-dns-peers", "juju-dns")
+        self.harness.begin()
+        self.harness.charm._stored.config = {"mode": "server"}
+        self.harness.charm.unit.status = ops.ActiveStatus()
+
+    def servers(self, relation_id: int) -> list:
+        return json.loads(self.harness.get_relation_data(relation_id, "juju-dns")["servers"])
+
+    def test_unit_endpoint_published(self):
+        clients = self.harness.add_relation("dns-endpoints", "client")
+        self.harness.add_relation_unit(clients, "client/0")
+
+        self.assertEqual(
+            self.harness.get_relation_data(clients, "juju-dns/0"),
+            {"address": "10.0.0.10", "port": "1053", "transports": "udp", "health": "active"},
+        )
+
+    def test_leader_publishes_every_unit(self):
+        self.harness.set_leader(True)
+        clients = self.harness.add_relation("dns-endpoints", "client")
+        self.harness.add_relation_unit(clients, "client/0")
+        self.harness.add_relation_unit(self.peers, "juju-dns/1")
+        self.harness.update_relation_data(
+            self.peers,
+            "juju-dns/1",
+            {"address": "10.0.0.11", "port": "5353", "transports": "udp", "health": "waiting"},
+        )
+
+        self.assertEqual(
+            self.servers(clients),
+            [
+                {
+                    "unit": "juju-dns/0",
+                    "address": "10.0.0.10",
+                    "port": 1053,
+                    "transports": ["udp"],
+                    "health": "active",
+                },
+                {
+                    "unit": "juju-dns/1",
+                    "address": "10.0.0.11",
+                    "port": 5353,
+                    "transports": ["udp"],
+                    "health": "waiting",
+                },
+            ],
+        )
+
+        self.harness.remove_relation_unit(self.peers, "juju-dns/1")
+        self.assertEqual([server["unit"] for server in self.servers(clients)], ["juju-dns/0"])
+
+    def test_node_local_unit_not_published(self):
+        self.harness.charm._stored.config = {"mode": "node-local"}
+        clients = self.harness.add_relation("dns-endpoints", "client")
+        self.harness.add_relation_unit(clients, "client/0")
+
+        self.assertEqual(self.harness.get_relation_data(clients, "juju-dns/0"), {})
@@ -0,0 +1,105 @@
+# Copyright 2024 nicolas
+# See LICENSE file for licensing details.
+
+import os
+import tempfile
+import time
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import ops
+import ops.testing
+from charms.operator_libs_linux.v2 import snap
+
+import health
+from charm import JujuDnsCharm
+
+
+class TestSample(unittest.TestCase):
+    def test_sample(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        process = Path(tmp.name, "42")
+        (process / "fd").mkdir(parents=True)
+        ticks = os.sysconf("SC_CLK_TCK")
+        stat = ["42", "(core dns)", "S"] + ["0"] * 10 + [str(3 * ticks), str(ticks)] + ["0"] * 30
+        (process / "stat").write_text(" ".join(stat))
+        (process / "status").write_text("Name:\tcoredns\nVmRSS:\t   2048 kB\n")
+        os.symlink("socket:[1234]", process / "fd" / "3")
+        os.symlink("socket:[1235]", process / "fd" / "4")
+        os.symlink("/dev/null", process / "fd" / "0")
+
+        self.assertEqual(
+            health.sample(42, proc=tmp.name), {"cpu": 4.0, "rss": 2048 * 1024, "sockets": 2}
+        )
+
+    def test_cpu_percent(self):
+        window = [{"time": 0, "cpu": 1.0}, {"time": 300, "cpu": 4.0}, {"time": 600, "cpu": 7.0}]
+        self.assertEqual(health.cpu_percent(window), 1.0)
+        self.assertEqual(health.cpu_percent(window[:1]), 0.0)
+
+
+class TestHealthStatus(unittest.TestCase):
+    def setUp(self):
+        self.harness = ops.testing.Harness(JujuDnsCharm)
+        self.addCleanup(self.harness.cleanup)
+        self.harness.begin()
+        self.harness.charm._stored.config = {"health-max-rss": 100, "health-max-cpu": 50}
+        self.harness.charm.unit.status = ops.ActiveStatus()
+
+        self.pid = "42"
+        juju_dns = mock.MagicMock(services={"coredns": {}})
+        patchers = [
+            mock.patch.object(snap, "SnapCache", return_value={"juju-dns": juju_dns}),
+            mock.patch("service.show", side_effect=lambda unit, _: {"MainPID": self.pid}),
+            mock.patch("health.sample"),
+            mock.patch("time.time"),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def update_status(self, now: float, cpu: float, rss_mib: float, sockets: int = 4):
+        health.sample.return_value = {"cpu": cpu, "rss": rss_mib * 1024 * 1024, "sockets": sockets}
+        time.time.return_value = now
+        self.harness.charm.on.update_status.emit()
+        return self.harness.model.unit.status
+
+    def test_usage_in_status(self):
+        self.update_status(0, 10.0, 40)
+        status = self.update_status(300, 40.0, 42.5)
+
+        self.assertEqual(status, ops.ActiveStatus("rss 42.5 MiB, cpu 10.0%, 4 sockets"))
+        self.assertEqual(len(self.harness.charm._stored.health), 2)
+
+    def test_over_thresholds_waits(self):
+        self.update_status(0, 10.0, 40)
+        status = self.update_status(100, 70.0, 120)
+
+        self.assertEqual(
+            status,
+            ops.WaitingStatus(
+                "rss 120.0 MiB, cpu 60.0%, 4 sockets (rss over 100 MiB, cpu over 50%)"
+            ),
+        )
+
+        # Back under the thresholds once the window moved past the spike.
+        for now in range(200, 1000, 100):
+            status = self.update_status(now, 70.0 + now / 100, 50)
+        self.assertIsInstance(status, ops.ActiveStatus)
+
+    def test_restart_resets_the_window(self):
+        self.update_status(0, 10.0, 40)
+        self.pid = "43"
+        status = self.update_status(300, 0.5, 40)
+
+        self.assertEqual(len(self.harness.charm._stored.health), 1)
+        self.assertEqual(status, ops.ActiveStatus("rss 40.0 MiB, cpu 0.0%, 4 sockets"))
+
+    def test_blocked_status_is_kept(self):
+        self.harness.charm.unit.status = ops.BlockedStatus("invalid config")
+        status = self.update_status(0, 10.0, 40)
+
+        self.assertEqual(status, ops.BlockedStatus("invalid config"))
+        health.sample.assert_not_called()
@@ -0,0 +1,165 @@
+# Copyright 2024 nicolas
+# See LICENSE file for licensing details.
+
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import ops
+import ops.testing
+from charms.operator_libs_linux.v2 import snap
+
+import charm
+import history
+from charm import JujuDnsCharm
+
+
+class TestConfigHistory(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dir = Path(tmp.name)
+        self.corefile = self.dir / "Corefile"
+        self.plugin = self.dir / "juju-dns.yaml"
+        self.paths = [str(self.corefile), str(self.plugin)]
+        self.configs = history.ConfigHistory(str(self.dir / "history"), 2)
+        (self.dir / "history").mkdir()
+
+    def write(self, corefile: str, plugin: str = "ttl: 60\n"):
+        self.corefile.write_text(corefile)
+        self.plugin.write_text(plugin)
+
+    def test_save_keeps_the_newest(self):
+        digests = []
+        for version in range(3):
+            self.write(f"version {version}\n")
+            digests.append(self.configs.save(self.paths))
+
+        self.assertEqual(self.configs.digests(), [digests[2], digests[1]])
+        self.assertFalse((self.dir / "history" / digests[0]).exists())
+
+        # Saving a known set again moves it first, without copying it again.
+        self.write("version 1\n")
+        self.assertEqual(self.configs.save(self.paths), digests[1])
+        self.assertEqual(self.configs.digests(), [digests[1], digests[2]])
+
+    def test_restore(self):
+        self.write("good\n", "ttl: 30\n")
+        good = self.configs.save(self.paths)
+        self.write("broken\n", "ttl: 0\n")
+
+        self.configs.restore(good, self.paths)
+
+        self.assertEqual(self.corefile.read_text(), "good\n")
+        self.assertEqual(self.plugin.read_text(), "ttl: 30\n")
+        self.assertEqual(history.ConfigHistory.digest(self.paths), good)
+
+
+class TestRollback(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dir = Path(tmp.name)
+        self.corefile = self.dir / "Corefile"
+        self.answering = []
+        self.current = ""
+
+        self.juju_dns = mock.MagicMock(services={"coredns": {}})
+        patchers = [
+            mock.patch.object(charm, "COREFILE_PATH", str(self.corefile)),
+            mock.patch.object(
+                charm, "JUJU_DNS_PLUGIN_CONFIG_PATH", str(self.dir / "juju-dns.yaml")
+            ),
+            mock.patch.object(charm, "CONFIG_HISTORY_PATH", str(self.dir / "history")),
+            mock.patch.object(snap, "SnapCache", return_value={"juju-dns": self.juju_dns}),
+            mock.patch("metrics.wait_ready", side_effect=lambda *_: self.answering.pop(0)),
+            mock.patch.object(
+                JujuDnsCharm,
+                "_render_corefile",
+                side_effect=lambda: self.corefile.write_text(self.current),
+            ),
+            mock.patch.object(JujuDnsCharm, "_render_config"),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.harness = ops.testing.Harness(JujuDnsCharm)
+        self.addCleanup(self.harness.cleanup)
+        self.harness.begin()
+        self.harness.charm._stored.config = {"config-history-size": 5}
+
+    def restart(self, corefile: str, *answering: bool, services=None):
+        self.current = corefile
+        self.corefile.write_text(corefile)
+        self.answering = list(answering)
+        self.harness.charm._restart_snap(services)
+
+    def test_good_config_is_saved(self):
+        self.restart("good\n", True)
+
+        history_ = history.ConfigHistory(str(self.dir / "history"), 5)
+        self.assertEqual(len(history_.digests()), 1)
+        self.assertEqual(self.harness.charm._ready_status(), ops.ActiveStatus())
+
+    def test_failed_config_rolls_back(self):
+        self.restart("good\n", True)
+        self.restart("broken\n", False, True)
+
+        self.assertEqual(self.corefile.read_text(), "good\n")
+        self.assertEqual(self.juju_dns.restart.call_count, 3)
+        self.assertIsInstance(self.harness.charm._ready_status(), ops.BlockedStatus)
+        self.assertIn("rolled back", self.harness.charm._ready_status().message)
+        self.assertEqual(
+            [event["result"] for event in self.harness.charm._stored.config_events],
+            ["good", "failed", "rolled-back"],
+        )
+
+        # A config that answers again clears the rollback.
+        self.restart("fixed\n", True)
+        self.assertEqual(self.harness.charm._ready_status(), ops.ActiveStatus())
+
+    def test_rolled_back_config_is_rendered_again(self):
+        self.restart("good\n", True)
+        self.restart("broken\n", False, True)
+
+        # A change to another option renders the whole current config again,
+        # which still fails: the unit doesn't turn active on the rolled back files.
+        self.answering = [False, True]
+        self.harness.charm._restart_snap()
+        self.assertEqual(self.corefile.read_text(), "good\n")
+        self.assertIn("rolled back", self.harness.charm._ready_status().message)
+
+    def test_partial_restart_is_probed(self):
+        self.restart("good\n", True)
+        self.restart("good\n", False, services=["coredns"])
+
+        # Nothing to roll back: the files didn't change.
+        self.juju_dns.restart.assert_called_with(["coredns"])
+        self.assertEqual(self.juju_dns.restart.call_count, 2)
+        self.assertEqual(
+            self.harness.charm._ready_status(),
+            ops.BlockedStatus(
+                "juju-dns is not ready with known-good config "
+                + history.ConfigHistory.digest(
+                    [str(self.corefile), str(self.dir / "juju-dns.yaml")]
+                )[:12]
+            ),
+        )
+
+    def test_nothing_to_roll_back_to(self):
+        self.restart("broken\n", False)
+
+        self.assertEqual(self.corefile.read_text(), "broken\n")
+        self.assertEqual(self.juju_dns.restart.call_count, 1)
+        self.assertIn("no known-good config", self.harness.charm._ready_status().message)
+
+    def test_config_history_action(self):
+        self.restart("good\n", True)
+        self.restart("broken\n", False, True)
+
+        results = self.harness.run_action("config-history").results
+        self.assertEqual(results["current"], results["known-good"])
+        self.assertEqual(len(results["events"].splitlines()), 3)
+        self.assertTrue(results["rollback"].startswith("config "))
@@ -0,0 +1,83 @@
+# Copyright 2024 nicolas
+# See LICENSE file for licensing details.
+#
+# Import-time benchmark for the charm entrypoint. Every hook dispatch imports
+# src/charm.py, so anything it pulls in at module level is paid on every hook.
+
+import os
+import subprocess
+import sys
+import unittest
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[2]
+
+# Modules that must only be imported by the handlers that need them.
+LAZY_MODULES = ("jinja2", "charms.operator_libs_linux.v2.snap")
+
+# What `import charm` loads on top of `import ops`, in microseconds, as last
+# measured (best of 7 runs). A change that raises it updates the figure here,
+# and says what the extra time buys:
+#   2_400  lazy handler imports: charm and constants only
+#   7_300  typed config model, with its option table and parsers (config)
+#  10_600  sysctl, resource controls, health checks and watch mode (charm, config)
+#  14_400  node-local mode, latency ranking, history and reverse maps (charm)
+MEASURED_IMPORT_US = 14_400
+
+# Budget, in microseconds: the measured cost plus a margin for machine noise,
+# tight enough that a new module-level import fails the test.
+IMPORT_BUDGET_US = int(MEASURED_IMPORT_US * 1.25)
+
+# Best-of-N runs, to smooth out noise from a loaded CI machine.
+RUNS = 3
+
+
+def import_times(module: str) -> dict:
+    """Return {module: self time in us} parsed from `python -X importtime`."""
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(
+        [str(ROOT / "lib"), str(ROOT / "src"), env.get("PYTHONPATH", "")]
+    )
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, _, name = line[len("import time:") :].split("|")
+        times[name.strip()] = int(self_us)
+    return times
+
+
+def charm_import_report() -> dict:
+    """Return the fastest of RUNS measurements of what `import charm` adds to `import ops`."""
+    best = None
+    for _ in range(RUNS):
+        baseline = import_times("ops")
+        charm = import_times("charm")
+        extra = {name: us for name, us in charm.items() if name not in baseline}
+        if best is None or sum(extra.values()) < sum(best.values()):
+            best = extra
+    return best
+
+
+class TestImportTime(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.report = charm_import_report()
+        total = sum(cls.report.values())
+        print(f"\ncharm import cost on top of ops: {total} us (budget {IMPORT_BUDGET_US} us)")
+        for name, us in sorted(cls.report.items(), key=lambda item: -item[1])[:10]:
+            print(f"  {us:>8} us  {name}")
+
+    def test_heavy_modules_are_lazy(self):
+        for module in LAZY_MODULES:
+            self.assertNotIn(module, self.report)
+
+    def test_import_budget(self):
+        self.assertLessEqual(sum(self.report.values()), IMPORT_BUDGET_US)
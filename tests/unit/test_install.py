@@ -0,0 +1,203 @@
+# Copyright 2024 nicolas
+# See LICENSE file for licensing details.
+
+import unittest
+from unittest import mock
+
+import ops
+import ops.testing
+from charms.operator_libs_linux.v2 import snap
+
+from charm import JujuDnsCharm
+
+
+def change(ready: bool, status: str = "Doing", done: int = 0, total: int = 0, err: str = ""):
+    return snap.SnapChange(
+        {
+            "id": "7",
+            "status": status,
+            "ready": ready,
+            "err": err,
+            "tasks": [
+                {
+                    "summary": 'Download snap "juju-dns" (6)',
+                    "status": "Done" if ready else "Doing",
+                    "progress": {"done": done, "total": total},
+                }
+            ],
+        }
+    )
+
+
+class InstallTestCase(unittest.TestCase):
+    install_mode = "blocking"
+
+    def setUp(self):
+        self.harness = ops.testing.Harness(JujuDnsCharm)
+        self.addCleanup(self.harness.cleanup)
+        self.harness.update_config({"install-mode": self.install_mode})
+
+        self.juju_dns = mock.MagicMock(present=False)
+        patchers = [
+            mock.patch.object(snap, "SnapCache", return_value={"juju-dns": self.juju_dns}),
+            mock.patch.object(snap, "install_batch", return_value={"juju-dns": "7"}),
+            mock.patch.object(snap, "get_change"),
+            mock.patch.object(snap, "wait_for_changes"),
+            mock.patch.object(snap, "hold_batch"),
+            mock.patch("platform.machine", return_value="x86_64"),
+            mock.patch.object(JujuDnsCharm, "_render_corefile"),
+            mock.patch.object(JujuDnsCharm, "_render_config"),
+            mock.patch.object(JujuDnsCharm, "_apply_sysctl"),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.harness.begin()
+
+
+class TestInstall(InstallTestCase):
+    def test_install_in_one_batch(self):
+        self.harness.charm.on.install.emit()
+
+        snap.install_batch.assert_called_once_with({"juju-dns": {"revision": "6"}})
+        snap.wait_for_changes.assert_called_once()
+        self.assertEqual(list(snap.wait_for_changes.call_args.args[0]), ["7"])
+        snap.hold_batch.assert_called_once_with(["juju-dns"])
+        self.assertEqual(self.harness.model.unit.status, ops.ActiveStatus("Ready"))
+
+    def test_installed_snaps_are_skipped(self):
+        self.juju_dns.present = True
+        self.harness.charm.on.install.emit()
+
+        snap.install_batch.assert_not_called()
+        self.assertEqual(self.harness.model.unit.status, ops.ActiveStatus("Ready"))
+
+
+class TestAsyncInstall(InstallTestCase):
+    install_mode = "async"
+
+    def test_install_does_not_wait(self):
+        self.harness.charm.on.install.emit()
+
+        snap.install_batch.assert_called_once_with({"juju-dns": {"revision": "6"}})
+        snap.wait_for_changes.assert_not_called()
+        self.assertEqual(self.harness.charm._stored.install_changes, {"juju-dns": "7"})
+        self.assertIsInstance(self.harness.model.unit.status, ops.MaintenanceStatus)
+
+    def test_progress_then_activation(self):
+        self.harness.charm.on.install.emit()
+
+        snap.get_change.return_value = change(False, done=25, total=100)
+        self.harness.charm.on.update_status.emit()
+        self.assertEqual(
+            self.harness.model.unit.status,
+            ops.MaintenanceStatus('Installing: 25% (Download snap "juju-dns" (6))'),
+        )
+        JujuDnsCharm._render_corefile.assert_not_called()
+
+        snap.get_change.return_value = change(True, status="Done", done=100, total=100)
+        self.harness.charm.on.update_status.emit()
+        snap.hold_batch.assert_called_once_with(["juju-dns"])
+        JujuDnsCharm._render_corefile.assert_called_once()
+        JujuDnsCharm._render_config.assert_called_once()
+        self.assertEqual(self.harness.charm._stored.install_changes, {})
+        self.assertEqual(self.harness.model.unit.status, ops.ActiveStatus())
+
+    def test_invalid_config_during_install_blocks(self):
+        self.harness.charm.on.install.emit()
+        self.harness.update_config({"port": 70000})
+        blocked = self.harness.model.unit.status
+        self.assertIsInstance(blocked, ops.BlockedStatus)
+
+        snap.get_change.return_value = change(True, status="Done", done=100, total=100)
+        self.harness.charm.on.update_status.emit()
+
+        self.assertEqual(self.harness.charm._stored.install_changes, {})
+        self.assertEqual(self.harness.model.unit.status, blocked)
+
+    def test_failed_install_blocks(self):
+        self.harness.charm.on.install.emit()
+
+        snap.get_change.return_value = change(True, status="Error", err="no space left")
+        self.harness.charm.on.update_status.emit()
+
+        self.assertEqual(
+            self.harness.model.unit.status,
+            ops.BlockedStatus("Installing juju-dns failed: no space left"),
+        )
+        JujuDnsCharm._render_corefile.assert_not_called()
+
+
+class TestUpgrade(InstallTestCase):
+    def setUp(self):
+        super().setUp()
+        self.juju_dns.present = True
+        self.juju_dns.revision = "6"
+        patcher = mock.patch.object(snap, "refresh_batch", return_value={"juju-dns": "8"})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        JujuDnsCharm._render_corefile.return_value = False
+        JujuDnsCharm._render_config.return_value = False
+        JujuDnsCharm._apply_sysctl.return_value = False
+        patcher = mock.patch.object(JujuDnsCharm, "_apply_resource_controls", return_value=[])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_current_revision_is_not_refreshed(self):
+        with mock.patch.object(JujuDnsCharm, "_restart_snap") as restart:
+            self.harness.charm.on.upgrade_charm.emit()
+
+        snap.refresh_batch.assert_not_called()
+        restart.assert_not_called()
+        self.assertEqual(self.harness.model.unit.status, ops.ActiveStatus())
+
+    def test_changed_system_templates_applied(self):
+        self.harness.charm._stored.config = {"rmem-max": 0}
+        JujuDnsCharm._apply_resource_controls.return_value = ["coredns"]
+        with mock.patch.object(JujuDnsCharm, "_restart_snap") as restart:
+            self.harness.charm.on.upgrade_charm.emit()
+
+        JujuDnsCharm._apply_sysctl.assert_called_once_with({"rmem-max": 0})
+        restart.assert_called_once_with(["coredns"])
+
+        # A changed sysctl drop-in takes a full restart, once.
+        JujuDnsCharm._apply_sysctl.return_value = True
+        with mock.patch.object(JujuDnsCharm, "_restart_snap") as restart:
+            self.harness.charm.on.upgrade_charm.emit()
+        restart.assert_called_once_with()
+
+    def test_invalid_config_stays_blocked(self):
+        self.harness.update_config({"port": 70000})
+        blocked = self.harness.model.unit.status
+        self.harness.charm.on.upgrade_charm.emit()
+
+        self.assertIsInstance(blocked, ops.BlockedStatus)
+        self.assertEqual(self.harness.model.unit.status, blocked)
+
+    def test_changed_template_restarts_once(self):
+        JujuDnsCharm._render_config.return_value = True
+        with mock.patch.object(JujuDnsCharm, "_restart_snap") as restart:
+            self.harness.charm.on.upgrade_charm.emit()
+
+        snap.refresh_batch.assert_not_called()
+        restart.assert_called_once()
+
+    def test_new_pinned_revision_is_refreshed(self):
+        self.juju_dns.revision = "5"
+        JujuDnsCharm._render_corefile.return_value = True
+        with mock.patch.object(JujuDnsCharm, "_restart_snap") as restart:
+            self.harness.charm.on.upgrade_charm.emit()
+
+        snap.refresh_batch.assert_called_once_with({"juju-dns": {"revision": "6"}})
+        snap.hold_batch.assert_called_once_with(["juju-dns"])
+        # The refresh restarts the service with the new files already in place.
+        restart.assert_not_called()
+
+    def test_refresh_is_probed(self):
+        self.juju_dns.revision = "5"
+        self.harness.charm._stored.config = {"rmem-max": 0}
+        with mock.patch.object(JujuDnsCharm, "_probe_restart") as probe:
+            self.harness.charm.on.upgrade_charm.emit()
+
+        snap.refresh_batch.assert_called_once()
+        probe.assert_called_once_with(self.juju_dns)
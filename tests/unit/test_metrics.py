@@ -0,0 +1,90 @@
+# Copyright 2024 nicolas
+# See LICENSE file for licensing details.
+
+import tempfile
+import unittest
+from unittest import mock
+
+import ops.testing
+from charms.operator_libs_linux.v2 import snap
+
+import metrics
+from charm import JujuDnsCharm
+
+METRICS = """\
+# HELP coredns_cache_hits_total The count of cache hits.
+# TYPE coredns_cache_hits_total counter
+coredns_cache_hits_total{server="dns://:1053",type="denial",view="",zones="."} 42
+coredns_cache_hits_total{server="dns://:1053",type="success",view="",zones="."} 7
+coredns_dns_requests_total{family="1",proto="udp",server="dns://:1053",type="A",view="",zone="."} 60
+coredns_dns_responses_total{plugin="juju",rcode="NXDOMAIN",server="dns://:1053",view="",zone="."} 50
+coredns_dns_responses_total{plugin="juju",rcode="NOERROR",server="dns://:1053",view="",zone="."} 10
+"""
+
+SNMP = """\
+Ip: Forwarding DefaultTTL InReceives
+Ip: 1 64 1000
+Udp: InDatagrams NoPorts InErrors OutDatagrams RcvbufErrors SndbufErrors
+Udp: 900 2 17 880 15 0
+UdpLite: InDatagrams NoPorts InErrors OutDatagrams RcvbufErrors SndbufErrors
+UdpLite: 0 0 0 0 0 0
+"""
+
+
+class TestMetrics(unittest.TestCase):
+    def test_total_filters_on_labels(self):
+        samples = metrics.parse(METRICS)
+        self.assertEqual(metrics.total(samples, "coredns_cache_hits_total"), 49)
+        self.assertEqual(metrics.total(samples, "coredns_cache_hits_total", type="denial"), 42)
+        self.assertEqual(metrics.total(samples, "coredns_missing_total"), 0)
+
+    def test_snmp_counters(self):
+        with tempfile.NamedTemporaryFile("w") as snmp:
+            snmp.write(SNMP)
+            snmp.flush()
+
+            udp = metrics.snmp_counters("Udp", snmp.name)
+            self.assertEqual(udp["RcvbufErrors"], 15)
+            self.assertEqual(udp["InErrors"], 17)
+            self.assertEqual(metrics.snmp_counters("Icmp", snmp.name), {})
+
+    def test_stats_action(self):
+        harness = ops.testing.Harness(JujuDnsCharm)
+        self.addCleanup(harness.cleanup)
+        harness.begin()
+        harness.charm._stored.config = {"log-denials": True}
+
+        juju_dns = mock.MagicMock(services={"coredns": {}})
+        properties = {"CPUQuotaPerSecUSec": "500ms", "AllowedCPUs": "2-3", "Nice": "-5"}
+        with mock.patch("metrics.scrape", return_value=metrics.parse(METRICS)):
+            with mock.patch("metrics.snmp_counters", return_value={"RcvbufErrors": 15}):
+                with mock.patch.object(snap, "SnapCache", return_value={"juju-dns": juju_dns}):
+                    with mock.patch("service.show", return_value=properties) as show:
+                        with mock.patch(
+                            "querylog.denied_clients",
+                            return_value=[("10.0.0.7", 120), ("10.0.0.2", 4)],
+                        ):
+                            output = harness.run_action("stats")
+
+        show.assert_called_once_with("snap.juju-dns.coredns.service", mock.ANY)
+
+        self.assertEqual(
+            output.results,
+            {
+                "services": {
+                    "coredns": {
+                        "cpu-quota-per-sec": "500ms",
+                        "cpu-affinity": "2-3",
+                        "memory-max": "",
+                        "io-weight": "",
+                        "nice": "-5",
+                    }
+                },
+                "udp-receive-buffer-errors": 15,
+                "udp-receive-errors": 0,
+                "queries": 60,
+                "nxdomain-responses": 50,
+                "denial-cache-hits": 42,
+                "denied-clients": "120 10.0.0.7\n4 10.0.0.2",
+            },
+        )
@@ -0,0 +1,41 @@
+# Copyright 2024 nicolas
+# See LICENSE file for licensing details.
+
+import asyncio
+import socket
+import unittest
+
+import probe
+
+
+class TestProbe(unittest.TestCase):
+    def test_connect_latency(self):
+        listener = socket.socket()
+        listener.bind(("127.0.0.1", 0))
+        listener.listen()
+        self.addCleanup(listener.close)
+        closed = socket.socket()
+        closed.bind(("127.0.0.1", 0))
+        self.addCleanup(closed.close)
+        up = "127.0.0.1:%d" % listener.getsockname()[1]
+        down = "127.0.0.1:%d" % closed.getsockname()[1]
+
+        latencies = asyncio.run(probe.probe([up, down, up], timeout=1.0))
+
+        self.assertEqual(list(latencies), [up, down])
+        self.assertLess(latencies[up], 1.0)
+        self.assertIsNone(latencies[down])
+
+    def test_rank(self):
+        latencies = {"a:1": None, "b:1": 0.010, "c:1": 0.002, "d:1": 0.004}
+        self.assertEqual(probe.rank(latencies), ["c:1", "d:1", "b:1", "a:1"])
+
+    def test_rank_keeps_the_current_address_within_stickiness(self):
+        latencies = {"b:1": 0.0025, "c:1": 0.002}
+        self.assertEqual(probe.rank(latencies, ["b:1", "c:1"]), ["b:1", "c:1"])
+
+        latencies = {"b:1": 0.004, "c:1": 0.002}
+        self.assertEqual(probe.rank(latencies, ["b:1", "c:1"]), ["c:1", "b:1"])
+
+        latencies = {"b:1": None, "c:1": 0.002}
+        self.assertEqual(probe.rank(latencies, ["b:1", "c:1"]), ["c:1", "b:1"])
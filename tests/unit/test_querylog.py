@@ -0,0 +1,143 @@
+# Copyright 2024 nicolas
+# See LICENSE file for licensing details.
+
+import json
+import os
+import subprocess
+import tempfile
+import unittest
+from unittest import mock
+
+import ops.testing
+
+import querylog
+from charm import JujuDnsCharm
+
+
+def record(name: str, remote: str = "10.0.0.2", duration: str = "0.001s", rcode="NOERROR"):
+    return json.dumps(
+        {
+            "remote": remote,
+            "name": name,
+            "type": "A",
+            "proto": "udp",
+            "rcode": rcode,
+            "size": 80,
+            "duration": duration,
+        },
+        separators=(",", ":"),
+    )
+
+
+class TestRingBuffer(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.directory = tmp.name
+
+    def test_size_is_capped(self):
+        buffer = querylog.RingBuffer(self.directory, 1000)
+        records = [f"{i:09d}" for i in range(500)]
+
+        self.assertEqual(buffer.append(records[:300]), 300)
+        self.assertEqual(buffer.append(records[300:]), 200)
+
+        kept = buffer.read()
+        used = sum(
+            os.path.getsize(os.path.join(self.directory, f)) for f in os.listdir(self.directory)
+        )
+        self.assertLessEqual(used, 1000)
+        self.assertEqual(kept, records[-len(kept) :])
+        self.assertGreaterEqual(len(kept), 50)
+
+    def test_empty(self):
+        self.assertEqual(querylog.RingBuffer(self.directory, 1000).read(), [])
+
+
+class TestQueryLog(unittest.TestCase):
+    def test_collect_follows_the_cursor(self):
+        output = "\n".join(
+            [
+                "[INFO] " + record("a.juju.local"),
+                "[INFO] plugin/reload: Running",
+                "-- cursor: s=2",
+            ]
+        )
+        completed = subprocess.CompletedProcess([], 0, stdout=output)
+        with mock.patch("subprocess.run", return_value=completed) as run:
+            lines, cursor = querylog.collect("s=1")
+
+        self.assertEqual(lines, [record("a.juju.local")])
+        self.assertEqual(cursor, "s=2")
+        self.assertEqual(run.call_args.args[0][-2:], ["--after-cursor", "s=1"])
+
+    def test_denied_clients(self):
+        def denial(remote: str) -> str:
+            return json.dumps(
+                {
+                    "answer": "denied",
+                    "remote": remote,
+                    "name": "x.juju.local",
+                    "rcode": "NXDOMAIN",
+                },
+                separators=(",", ":"),
+            )
+
+        output = "\n".join(
+            [
+                "[INFO] " + denial("10.0.0.7"),
+                "[INFO] " + denial("10.0.0.7"),
+                "[INFO] " + denial("10.0.0.2"),
+                "[INFO] " + record("a.juju.local"),
+            ]
+        )
+        completed = subprocess.CompletedProcess([], 0, stdout=output)
+        with mock.patch("subprocess.run", return_value=completed) as run:
+            clients = querylog.denied_clients(top=5)
+
+        self.assertEqual(clients, [("10.0.0.7", 2), ("10.0.0.2", 1)])
+        self.assertEqual(run.call_args.args[0][-2:], ["--since", "-1h"])
+
+    def test_summarize(self):
+        records = [
+            record("a.juju.local", duration="0.001s"),
+            record("a.juju.local", remote="10.0.0.3", duration="0.002s"),
+            record("b.juju.local", duration="0.25s", rcode="NXDOMAIN"),
+            "not json",
+        ]
+
+        summary = querylog.summarize(records, top=1)
+
+        self.assertEqual(summary["queries"], 3)
+        self.assertEqual(summary["top-names"], "2 a.juju.local A")
+        self.assertEqual(summary["top-clients"], "2 10.0.0.2")
+        self.assertEqual(summary["slowest"], "250.0ms b.juju.local A NXDOMAIN")
+        self.assertEqual(summary["rcodes"], {"noerror": 2, "nxdomain": 1})
+
+    def test_query_log_action(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        harness = ops.testing.Harness(JujuDnsCharm)
+        self.addCleanup(harness.cleanup)
+        harness.begin()
+        harness.charm._stored.config = {"query-log-sample": 10, "query-log-max-size": 1}
+
+        collected = ([record("a.juju.local"), record("b.juju.local")], "s=1")
+        with mock.patch("charm.QUERY_LOG_PATH", tmp.name):
+            with mock.patch("querylog.collect", return_value=collected) as collect:
+                output = harness.run_action("query-log", {"top": 5})
+
+        collect.assert_called_once_with("")
+        self.assertEqual(harness.charm._stored.query_log_cursor, "s=1")
+        self.assertEqual(output.results["queries"], 2)
+
+    def test_query_log_action_without_records(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        harness = ops.testing.Harness(JujuDnsCharm)
+        self.addCleanup(harness.cleanup)
+        harness.begin()
+
+        with mock.patch("charm.QUERY_LOG_PATH", tmp.name):
+            with self.assertRaises(ops.testing.ActionFailed):
+                harness.run_action("query-log")
@@ -0,0 +1,160 @@
+# Copyright 2024 nicolas
+# See LICENSE file for licensing details.
+
+import asyncio
+import socket
+import struct
+import threading
+import unittest
+
+import ops.testing
+
+import resolver
+from charm import JujuDnsCharm
+
+
+class FakeDnsServer(threading.Thread):
+    """Answer every A query for a name in `records` with its address, others with NXDOMAIN."""
+
+    def __init__(self, records: dict):
+        super().__init__(daemon=True)
+        self.records = records
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(("127.0.0.1", 0))
+        self.port = self.sock.getsockname()[1]
+        self.queries = []
+
+    def run(self):
+        while True:
+            try:
+                query, client = self.sock.recvfrom(512)
+            except OSError:
+                return
+            self.sock.sendto(self.answer(query), client)
+
+    def answer(self, query: bytes) -> bytes:
+        query_id = struct.unpack_from("!H", query)[0]
+        labels, offset = [], 12
+        while query[offset]:
+            labels.append(query[offset + 1 : offset + 1 + query[offset]].decode())
+            offset += 1 + query[offset]
+        question = query[12 : offset + 5]
+        name = ".".join(labels)
+        self.queries.append(name)
+
+        address = self.records.get(name)
+        if address is None:
+            return struct.pack("!HHHHHH", query_id, 0x8183, 1, 0, 0, 0) + question
+        answer = b"\xc0\x0c" + struct.pack("!HHIH", 1, 1, 60, 4) + socket.inet_aton(address)
+        return struct.pack("!HHHHHH", query_id, 0x8180, 1, 1, 0, 0) + question + answer
+
+    def stop(self):
+        self.sock.close()
+
+
+class TestResolver(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeDnsServer({"ubuntu.default.prod.juju.local": "10.0.0.7"})
+        self.server.start()
+        self.addCleanup(self.server.stop)
+
+    def test_resolve_all(self):
+        answers = asyncio.run(
+            resolver.resolve_all(
+                "127.0.0.1",
+                self.server.port,
+                ["ubuntu.default.prod.juju.local", "gone.default.prod.juju.local"],
+                concurrency=1,
+            )
+        )
+
+        self.assertEqual([answer.rcode for answer in answers], ["NOERROR", "NXDOMAIN"])
+        self.assertEqual(answers[0].addresses, ["10.0.0.7"])
+        self.assertFalse(answers[0].truncated)
+
+    def test_timeout(self):
+        silent = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        silent.bind(("127.0.0.1", 0))
+        self.addCleanup(silent.close)
+
+        answers = asyncio.run(
+            resolver.resolve_all(
+                "127.0.0.1", silent.getsockname()[1], ["a.juju.local"], timeout=0.1
+            )
+        )
+
+        self.assertEqual(answers[0].rcode, "TIMEOUT")
+
+    def test_edns0_buffer_size(self):
+        plain = resolver.encode_query(1, "a.juju.local")
+        query = resolver.encode_query(1, "a.juju.local", bufsize=1232)
+
+        self.assertEqual(struct.unpack_from("!H", query, 10)[0], 1)
+        self.assertEqual(query[: len(plain)], plain[:11] + b"\x01" + plain[12:])
+        self.assertEqual(query[len(plain) :], b"\x00" + struct.pack("!HHIH", 41, 1232, 0, 0))
+
+    def test_summarize_truncation_and_size(self):
+        answers = [
+            resolver.Answer("a", "NOERROR", 0.001, size=100),
+            resolver.Answer("b", "NOERROR", 0.002, size=500, truncated=True),
+            resolver.Answer("c", "TIMEOUT", 2.0),
+        ]
+
+        results = resolver.summarize(answers, 1.0)
+
+        self.assertEqual(results["truncated"], 1)
+        self.assertEqual(results["truncation-rate"], 0.5)
+        self.assertEqual(results["bytes-per-response"], 300)
+
+    def test_percentiles(self):
+        latencies = [i / 1000 for i in range(1, 101)]
+        self.assertEqual(
+            resolver.percentiles(latencies), {"p50": 50.0, "p95": 95.0, "p99": 99.0, "max": 100.0}
+        )
+        self.assertEqual(resolver.percentiles([]), {})
+
+    def test_warm_cache_action(self):
+        harness = ops.testing.Harness(JujuDnsCharm)
+        self.addCleanup(harness.cleanup)
+        harness.update_config({"warm-names": "ubuntu.default.{controller}.juju.local"})
+        relation_id = harness.add_relation("controller", "controller")
+        harness.add_relation_unit(relation_id, "controller/0")
+        harness.update_relation_data(
+            relation_id,
+            "controller/0",
+            {"controller_name": "prod", "address": "10.0.0.1", "username": "a", "password": "b"},
+        )
+        harness.begin()
+        harness.charm._stored.port = self.server.port
+
+        output = harness.run_action("warm-cache", {"names": "gone.default.prod.juju.local"})
+
+        self.assertEqual(output.results["names"], 2)
+        self.assertEqual(output.results["warmed"], 2)
+        self.assertEqual(output.results["timeouts"], 0)
+        self.assertIn("ubuntu.default.prod.juju.local", self.server.queries)
+
+    def test_benchmark_action(self):
+        harness = ops.testing.Harness(JujuDnsCharm)
+        self.addCleanup(harness.cleanup)
+        harness.begin()
+        harness.charm._stored.port = self.server.port
+
+        output = harness.run_action(
+            "benchmark",
+            {
+                "names": "ubuntu.default.prod.juju.local gone.default.prod.juju.local",
+                "qps": 200,
+                "duration": 0.5,
+            },
+        )
+
+        results = output.results
+        self.assertEqual(results["timeouts"], 0)
+        self.assertEqual(results["queries"], results["responses"])
+        self.assertAlmostEqual(results["queries"], 100, delta=10)
+        queries = results["queries"]
+        self.assertEqual(
+            results["rcodes"], {"noerror": queries - queries // 2, "nxdomain": queries // 2}
+        )
+        self.assertLessEqual(results["latency-ms"]["p50"], results["latency-ms"]["max"])
@@ -0,0 +1,63 @@
+# Copyright 2024 nicolas
+# See LICENSE file for licensing details.
+
+import unittest
+
+import reverse
+from resolver import TYPE_A, TYPE_AAAA, Answer
+
+
+class TestReverse(unittest.TestCase):
+    def test_update(self):
+        known = {"0.default.prod.juju.local": ["10.0.0.5"], "gone.prod.juju.local": ["10.0.0.9"]}
+        answers = {
+            TYPE_A: [
+                Answer("0.default.prod.juju.local", "TIMEOUT", 2.0),
+                Answer("1.default.prod.juju.local", "NOERROR", 0.001, addresses=["10.0.0.6"]),
+                Answer("2.default.prod.juju.local", "NXDOMAIN", 0.001),
+            ],
+            TYPE_AAAA: [
+                Answer("0.default.prod.juju.local", "TIMEOUT", 2.0),
+                Answer("1.default.prod.juju.local", "NOERROR", 0.001, addresses=["fd00::6"]),
+                Answer("2.default.prod.juju.local", "NXDOMAIN", 0.001),
+            ],
+        }
+
+        self.assertEqual(
+            reverse.update(known, answers),
+            {
+                # Kept while its controller doesn't answer.
+                "0.default.prod.juju.local": ["10.0.0.5"],
+                "1.default.prod.juju.local": ["10.0.0.6", "fd00::6"],
+            },
+        )
+
+    def test_update_per_query_type(self):
+        known = {"a.juju.local": ["10.0.0.1", "fd00::1"]}
+        answers = {
+            TYPE_A: [
+                Answer("a.juju.local", "NOERROR", 0.001, addresses=["10.0.0.2"]),
+                Answer("new.juju.local", "NOERROR", 0.001, addresses=["10.0.0.3"]),
+            ],
+            TYPE_AAAA: [
+                Answer("a.juju.local", "SERVFAIL", 0.001),
+                Answer("new.juju.local", "TIMEOUT", 2.0),
+            ],
+        }
+
+        # The fresh A answers are used, the AAAA ones fall back to the known addresses.
+        self.assertEqual(
+            reverse.update(known, answers),
+            {"a.juju.local": ["10.0.0.2", "fd00::1"], "new.juju.local": ["10.0.0.3"]},
+        )
+
+    def test_hosts_file(self):
+        names = {
+            "ubuntu.default.prod.juju.local": ["10.0.0.6"],
+            "1.default.prod.juju.local": ["10.0.0.6", "fd00::6"],
+        }
+        self.assertEqual(
+            reverse.hosts_file(names),
+            "10.0.0.6 1.default.prod.juju.local ubuntu.default.prod.juju.local\n"
+            "fd00::6 1.default.prod.juju.local\n",
+        )
@@ -0,0 +1,35 @@
+# Copyright 2024 nicolas
+# See LICENSE file for licensing details.
+
+import unittest
+
+import sharding
+
+CONTROLLERS = [f"controller-{i}" for i in range(200)]
+
+
+class TestSharding(unittest.TestCase):
+    def test_assign_is_deterministic_and_balanced(self):
+        units = ["juju-dns/0", "juju-dns/1", "juju-dns/2"]
+        owners = sharding.assign(CONTROLLERS, units)
+
+        self.assertEqual(owners, sharding.assign(CONTROLLERS, list(reversed(units))))
+        for unit in units:
+            self.assertGreater(list(owners.values()).count(unit), len(CONTROLLERS) / 6)
+
+    def test_adding_a_unit_only_moves_controllers_to_it(self):
+        before = sharding.assign(CONTROLLERS, ["juju-dns/0", "juju-dns/1", "juju-dns/2"])
+        after = sharding.assign(
+            CONTROLLERS, ["juju-dns/0", "juju-dns/1", "juju-dns/2", "juju-dns/3"]
+        )
+
+        moved = {name for name in CONTROLLERS if before[name] != after[name]}
+        self.assertTrue(moved)
+        self.assertEqual({after[name] for name in moved}, {"juju-dns/3"})
+
+    def test_removing_a_unit_only_moves_its_controllers(self):
+        before = sharding.assign(CONTROLLERS, ["juju-dns/0", "juju-dns/1", "juju-dns/2"])
+        after = sharding.assign(CONTROLLERS, ["juju-dns/0", "juju-dns/2"])
+
+        moved = {name for name in CONTROLLERS if before[name] != after[name]}
+        self.assertEqual(moved, {name for name in CONTROLLERS if before[name] == "juju-dns/1"})
@@ -0,0 +1,258 @@
+# Copyright 2024 nicolas
+# See LICENSE file for licensing details.
+#
+# Tests and benchmarks for the changes carried in the vendored snap library.
+
+import io
+import json
+import random
+import string
+import tempfile
+import time
+import tracemalloc
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from charms.operator_libs_linux.v2 import snap
+
+CATALOG_SIZE = 50_000
+INSTALLED_SNAPS = 500
+
+
+def synthetic_names(count: int) -> list:
+    rng = random.Random(42)
+    alphabet = string.ascii_lowercase + string.digits + "-"
+    names = set()
+    while len(names) < count:
+        names.add(rng.choice(string.ascii_lowercase) + "".join(rng.choices(alphabet, k=12)))
+    return sorted(names)
+
+
+class TestSnapCatalog(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = tempfile.TemporaryDirectory()
+        cls.names = synthetic_names(CATALOG_SIZE)
+        cls.path = Path(cls.tmp.name, "names")
+        cls.path.write_text("\n".join(cls.names) + "\n")
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp.cleanup()
+
+    def snap_cache(self, installed=()) -> snap.SnapCache:
+        client = mock.patch.object(
+            snap.SnapClient, "get_installed_snaps", return_value=list(installed)
+        )
+        with mock.patch.object(snap, "_SNAP_NAMES_PATH", str(self.path)), client:
+            with mock.patch.object(snap.SnapCache, "snapd_installed", True):
+                return snap.SnapCache()
+
+    def test_catalog_is_not_read_on_construction(self):
+        with mock.patch.object(snap._SnapCatalog, "load") as load:
+            self.snap_cache()
+        load.assert_not_called()
+
+    def test_membership(self):
+        cache = self.snap_cache()
+        self.assertIn(self.names[0], cache)
+        self.assertIn(self.names[-1], cache)
+        self.assertIn(self.names[CATALOG_SIZE // 2], cache)
+        self.assertNotIn("not-a-snap", cache)
+        self.assertEqual(len(cache), CATALOG_SIZE)
+
+    def test_unsorted_catalog(self):
+        path = Path(self.tmp.name, "unsorted")
+        path.write_text("lxd\n\ncharmcraft\njuju\n  juju-dns \nlxd\n")
+        catalog = snap._SnapCatalog(str(path))
+        self.assertEqual(list(catalog), ["charmcraft", "juju", "juju-dns", "lxd"])
+        self.assertIn("juju-dns", catalog)
+        self.assertNotIn("juju-db", catalog)
+
+    def test_missing_catalog(self):
+        catalog = snap._SnapCatalog(str(Path(self.tmp.name, "missing")))
+        self.assertEqual(len(catalog), 0)
+        self.assertNotIn("juju", catalog)
+
+    def test_iteration_yields_installed_snaps(self):
+        installed = {
+            "name": self.names[1],
+            "channel": "stable",
+            "revision": "1",
+            "confinement": "strict",
+        }
+        cache = self.snap_cache([installed])
+        snaps = [s for s in cache if s is not None]
+        self.assertEqual([s.name for s in snaps], [self.names[1]])
+
+    def test_benchmark(self):
+        tracemalloc.start()
+        start = time.perf_counter()
+        catalog = snap._SnapCatalog(str(self.path))
+        catalog.load()
+        load_time = time.perf_counter() - start
+        index_bytes, index_peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        tracemalloc.start()
+        start = time.perf_counter()
+        legacy = {}
+        with open(self.path) as f:
+            for line in f:
+                if line.strip():
+                    legacy[line.strip()] = None
+        legacy_time = time.perf_counter() - start
+        legacy_bytes, legacy_peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        lookups = random.Random(7).sample(self.names, 1000)
+        start = time.perf_counter()
+        for name in lookups:
+            self.assertIn(name, catalog)
+        lookup_time = (time.perf_counter() - start) / len(lookups)
+
+        print(
+            f"\n{CATALOG_SIZE} names: index {load_time * 1000:.1f} ms / {index_bytes // 1024} KiB,"
+            f" dict {legacy_time * 1000:.1f} ms / {legacy_bytes // 1024} KiB,"
+            f" lookup {lookup_time * 1e6:.1f} us, peak {index_peak // 1024} KiB"
+            f" vs {legacy_peak // 1024} KiB"
+        )
+        self.assertLess(index_bytes, legacy_bytes)
+        # The build never holds a copy of the file or a list of its lines.
+        self.assertLess(index_peak, legacy_peak)
+
+
+def snapd_document(i: int) -> dict:
+    """Return a /v2/snaps entry shaped like the ones snapd returns."""
+    name = f"snap-{i}"
+    return {
+        "id": f"{i:032x}",
+        "title": name,
+        "summary": f"The {name} snap",
+        "description": "A description of the snap. " * 20,
+        "icon": f"/v2/icons/{name}/icon",
+        "installed-size": 100_000_000 + i,
+        "install-date": "2024-03-01T10:00:00.000000000Z",
+        "name": name,
+        "publisher": {"id": "canonical", "username": "canonical", "validation": "verified"},
+        "developer": "canonical",
+        "status": "active",
+        "type": "app",
+        "base": "core22",
+        "version": "1.2.3",
+        "channel": "latest/stable",
+        "tracking-channel": "latest/stable",
+        "ignore-validation": False,
+        "revision": str(1000 + i),
+        "confinement": "strict",
+        "private": False,
+        "devmode": False,
+        "jailmode": False,
+        "apps": [{"snap": name, "name": name, "daemon": "simple", "enabled": True}],
+        "contact": "https://example.com",
+        "license": "Apache-2.0",
+        "mounted-from": f"/var/lib/snapd/snaps/{name}_{1000 + i}.snap",
+        "links": {"website": ["https://example.com"]},
+        "media": [{"type": "screenshot", "url": f"https://example.com/{name}.png"}],
+    }
+
+
+class FakeOpener:
+    def __init__(self, body: bytes):
+        self.body = body
+
+    def open(self, request, timeout=None):
+        return io.BytesIO(self.body)
+
+
+class TestInstalledSnaps(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        documents = [snapd_document(i) for i in range(INSTALLED_SNAPS)]
+        cls.body = json.dumps({"type": "sync", "result": documents}).encode()
+
+    def snap_cache(self) -> snap.SnapCache:
+        opener = mock.patch.object(
+            snap.SnapClient, "_get_default_opener", return_value=FakeOpener(self.body)
+        )
+        with opener, mock.patch.object(snap.SnapCache, "snapd_installed", True):
+            return snap.SnapCache()
+
+    def test_installed_snaps(self):
+        cache = self.snap_cache()
+        juju = cache["snap-7"]
+        self.assertEqual((juju.revision, juju.channel), ("1007", "latest/stable"))
+        self.assertEqual(juju.confinement, "strict")
+        self.assertFalse(hasattr(juju, "__dict__"))
+        self.assertIn("snap-7", repr(juju))
+        self.assertIs(juju._snap_client, cache._snap_client)
+
+    def test_snap_service(self):
+        service = snap.SnapService(daemon="simple", **{"daemon-scope": "system"})
+        self.assertEqual(service.as_dict()["daemon_scope"], "system")
+        self.assertFalse(hasattr(service, "__dict__"))
+
+    def test_benchmark(self):
+        tracemalloc.start()
+        start = time.perf_counter()
+        cache = self.snap_cache()
+        load_time = time.perf_counter() - start
+        retained, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        tracemalloc.start()
+        start = time.perf_counter()
+        full = json.loads(self.body.decode())["result"]
+        legacy_time = time.perf_counter() - start
+        legacy_retained = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+
+        print(
+            f"\n{INSTALLED_SNAPS} installed snaps: cache {load_time * 1000:.1f} ms,"
+            f" {retained // 1024} KiB retained / {peak // 1024} KiB peak;"
+            f" full documents {legacy_time * 1000:.1f} ms, {legacy_retained // 1024} KiB retained"
+        )
+        self.assertEqual(len(full), INSTALLED_SNAPS)
+        self.assertEqual(len(cache._snap_map), INSTALLED_SNAPS)
+        self.assertLess(retained, legacy_retained)
+
+
+class TestBatch(unittest.TestCase):
+    def setUp(self):
+        self.requests = []
+        patcher = mock.patch.object(snap.SnapClient, "_request_async", side_effect=self.request)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def request(self, method, path, body):
+        self.requests.append((method, path, body))
+        return str(len(self.requests))
+
+    def test_install_batch(self):
+        changes = snap.install_batch(
+            {"juju-dns": {"revision": "6"}, "node-exporter": {}, "jq": None}
+        )
+
+        self.assertEqual(changes, {"node-exporter": "1", "jq": "1", "juju-dns": "2"})
+        self.assertEqual(
+            self.requests,
+            [
+                ("POST", "snaps", {"action": "install", "snaps": ["node-exporter", "jq"]}),
+                ("POST", "snaps/juju-dns", {"action": "install", "revision": "6"}),
+            ],
+        )
+
+    def test_hold_batch(self):
+        with mock.patch.object(snap, "wait_for_changes") as wait:
+            snap.hold_batch(["juju-dns", "jq"])
+
+        body = {"action": "hold", "snaps": ["juju-dns", "jq"], "hold-level": "general"}
+        self.assertEqual(self.requests, [("POST", "snaps", {**body, "time": "forever"})])
+        wait.assert_called_once_with(["1"])
+
+    def test_wait_for_failed_change(self):
+        failed = snap.SnapChange({"id": "3", "status": "Error", "ready": True, "err": "boom"})
+        with mock.patch.object(snap, "get_change", return_value=failed):
+            with self.assertRaises(snap.SnapError):
+                snap.wait_for_changes(["3"], interval=0)